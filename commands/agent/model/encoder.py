@@ -1,4 +1,6 @@
 from systems.commands.index import Agent
+from utility.concurrency import get_limiter_stats
+from utility.transport import get_transport
 
 import statistics
 
@@ -35,7 +37,9 @@ class Encoder(Agent('model.encoder')):
                     'length_min': min(sentence_lengths),
                     'length_max': max(sentence_lengths),
                     'time': response.time,
-                    'memory': response.memory
+                    'memory': response.memory,
+                    'transport': get_transport().stats(),
+                    'concurrency': get_limiter_stats()
                 })
 
     def _parse_model_embeddings(self, sentences, config):
@@ -6,18 +6,29 @@ import statistics
 class SentenceParser(Agent('model.sentence_parser')):
 
     def exec(self):
+        self.preload_models()
         self.sentence_parser = self.get_sentence_parser()
 
         channel = 'agent:model:sentence_parser'
 
         for package in self.listen(channel, state_key = 'model_sentence_parser'):
-            text = package.message['text']
+            texts = package.message.get('texts', None)
+            text = package.message.get('text', '')
             config = package.message.get('config', {})
 
             try:
                 self.data('Processing sentence parsing request', package.sender)
-                response = self.profile(self._parse_model_sentences, text, config)
-                sentence_lengths = [ len(sentence) for sentence in response.result ]
+                if texts is not None:
+                    # Batched requests get one sentence list per text in order
+                    response = self.profile(self._parse_model_sentence_batch, texts, config)
+                    sentences = [ sentence for text_sentences in response.result for sentence in text_sentences ]
+                    text_length = sum([ len(text) for text in texts ])
+                else:
+                    response = self.profile(self._parse_model_sentences, text, config)
+                    sentences = response.result
+                    text_length = len(text)
+
+                sentence_lengths = [ len(sentence) for sentence in sentences ]
 
                 self.send(package.sender, response.result)
 
@@ -28,8 +39,8 @@ class SentenceParser(Agent('model.sentence_parser')):
             if sentence_lengths:
                 self.send("{}:stats".format(channel), {
                     'provider': self.sentence_parser.name,
-                    'length': len(text),
-                    'sentence_count': len(response.result),
+                    'length': text_length,
+                    'sentence_count': len(sentences),
                     'sentence_length_mean': round(statistics.mean(sentence_lengths), 1) if len(sentence_lengths) > 1 else sentence_lengths[0],
                     'sentence_length_sd': round(statistics.stdev(sentence_lengths), 1) if len(sentence_lengths) > 1 else 0,
                     'sentence_length_min': min(sentence_lengths),
@@ -40,3 +51,6 @@ class SentenceParser(Agent('model.sentence_parser')):
 
     def _parse_model_sentences(self, text, config):
         return self.sentence_parser.split(text, **config)
+
+    def _parse_model_sentence_batch(self, texts, config):
+        return self.sentence_parser.split_many(texts, **config)
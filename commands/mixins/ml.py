@@ -1,10 +1,24 @@
+from asgiref.sync import sync_to_async
+from concurrent.futures import Future
+from datetime import timedelta
 from django.conf import settings
+from django.utils import timezone
 
 from systems.commands.index import CommandMixin
+from systems.summary.chunker import get_section_offsets
 from utility.data import Collection, get_identifier, dump_json, ensure_list
+from utility.concurrency import get_limiter_stats
+from utility.cache import get_hash_key
+from utility.nlp import preload_spacy_models
+from utility.transport import get_transport
 
 import billiard as multiprocessing
-import re
+import asyncio
+import base64
+import numpy
+import threading
+import time
+import uuid
 
 
 def check_ending(text, endings):
@@ -18,17 +32,38 @@ def check_ending(text, endings):
     return False
 
 
+def check_result(result, endings):
+    # Streams stopped on a sentinel phrase are complete by definition
+    if result.get("finish_reason", None) == "sentinel":
+        return True
+    return check_ending(result["text"], endings)
+
+
 class MLCommandMixin(CommandMixin("ml")):
 
     provider_lock = multiprocessing.Lock()
 
+    summary_failure_message = "Summary generation was unsuccessful. Please retry with a modified question."
+    summary_cache_interval = 60
+    summary_cache_cutoff = None
+    summary_cache_checked = 0
+    summary_stream_ready_interval = 0.1
+    summary_stream_join_timeout = 5
+    summary_flights = {}
+    summary_flight_lock = threading.Lock()
+    summary_provider_lock = threading.Lock()
+
     def get_sentence_parser(self, **options):
+        provider = options.get("provider", None)
+        if not provider:
+            provider = settings.SENTENCE_PARSER_PROVIDERS
+
         with self.provider_lock:
             if not getattr(self, "providers", None):
                 self.providers = []
 
             provider = self._get_model_provider(
-                "sentence_parser", settings.SENTENCE_PARSER_PROVIDERS, options
+                "sentence_parser", ensure_list(provider), options
             )
             self._add_model(
                 provider.provider_type, provider.name, provider.field_device
@@ -36,19 +71,52 @@ class MLCommandMixin(CommandMixin("ml")):
             self.providers.append(provider)
         return provider
 
+    def preload_models(self):
+        # Agents call this on startup before any parser processes are forked
+        # so the forked processes share the loaded models
+        model_stats = preload_spacy_models()
+        if model_stats and self.debug and self.verbosity > 2:
+            self.data("Preloaded spaCy models", model_stats)
+        return model_stats
+
+    def _get_fast_sentence_parser(self):
+        if not getattr(self, "fast_sentence_parser", None):
+            self.fast_sentence_parser = self.get_sentence_parser(
+                provider=settings.SENTENCE_PARSER_FAST_PROVIDERS
+            )
+        return self.fast_sentence_parser
+
     def parse_sentences(self, text, **config):
         if not text:
             return []
 
-        sentences = []
-        for section in self.parse_text_sections(
+        section_length = 20
+        sections = self.parse_text_sections(
             text.encode("ascii", "ignore").decode().replace("\x00", "")
-        ):
-            section_sentences = self.submit(
-                "agent:model:sentence_parser", {"text": section, "config": config}
-            )
-            if section_sentences:
+        )
+        sentences = []
+
+        if not config.get("validate", True) and settings.SENTENCE_PARSER_FAST_PROVIDERS:
+            # Unvalidated splits need no model so they run in process instead
+            # of queueing behind model parsing on the sentence parser agents.
+            # Boundaries differ from the model parsers, so documents parsed
+            # before enabling this need their sentences and embeddings rebuilt
+            # since embeddings and index entries are keyed by sentence position
+            for section_sentences in self._get_fast_sentence_parser().split_many(
+                sections, **config
+            ):
                 sentences.extend(section_sentences)
+            return sentences
+
+        # Sections are sent in batches so the parser can pipe them together
+        for index in range(0, len(sections), section_length):
+            batch_sentences = self.submit(
+                "agent:model:sentence_parser",
+                {"texts": sections[index : index + section_length], "config": config},
+            )
+            for section_sentences in batch_sentences or []:
+                if section_sentences:
+                    sentences.extend(section_sentences)
 
         return sentences
 
@@ -86,6 +154,46 @@ class MLCommandMixin(CommandMixin("ml")):
 
         return embeddings
 
+    def _get_sentence_token_state_name(self, key):
+        return "ml.tokens.{}".format(key)
+
+    def get_sentence_token_counts(self, summarizer, sentences, key=None):
+        sentences = [
+            str(sentence).strip() if sentence else "" for sentence in sentences
+        ]
+        if not sentences:
+            return numpy.zeros(0, dtype=numpy.int32)
+
+        if not key or not settings.SUMMARIZER_SENTENCE_TOKENS_ENABLED:
+            return summarizer.get_token_counts(sentences).astype(numpy.int32)
+
+        # One entry per document holds the counts for every tokenizer and is
+        # replaced whenever the sentence content hash no longer matches
+        state_name = self._get_sentence_token_state_name(key)
+        tokenizer = summarizer.get_tokenizer_name()
+        sentence_hash = get_hash_key("\x00".join(sentences)).hex()
+
+        token_data = self.get_state(state_name, None) or {}
+        if token_data.get("sentences", None) != sentence_hash:
+            token_data = {"sentences": sentence_hash, "tokens": {}}
+
+        if tokenizer in token_data["tokens"]:
+            token_counts = numpy.frombuffer(
+                base64.b64decode(token_data["tokens"][tokenizer]), dtype=numpy.int32
+            )
+            if len(token_counts) == len(sentences):
+                return token_counts
+
+        token_counts = summarizer.get_token_counts(sentences).astype(numpy.int32)
+        token_data["tokens"][tokenizer] = base64.b64encode(
+            token_counts.tobytes()
+        ).decode()
+        self.set_state(state_name, token_data)
+        return token_counts
+
+    def clear_sentence_token_counts(self, key):
+        self.delete_state(self._get_sentence_token_state_name(key))
+
     def generate_text_embeddings(self, text, **config):
         sentences = self.parse_sentences(text, **config)
         text_data = None
@@ -116,81 +224,429 @@ class MLCommandMixin(CommandMixin("ml")):
 
         return provider
 
-    def generate_summary(self, text, **config):
-        summary_provider = config.get("provider", None)
-        summarizer = self.get_summarizer(init=False, provider=summary_provider)
+    def _get_request_summarizer(self, provider=None):
+        # Requests only submit work so providers are resolved uninitialized and
+        # once per name instead of registering a new instance for every chunk
+        key = tuple(ensure_list(provider)) if provider else None
 
-        summary_channel = "agent:model:{}".format(
-            summary_provider if summary_provider else "summary"
-        )
+        with self.summary_provider_lock:
+            if not getattr(self, "request_summarizers", None):
+                self.request_summarizers = {}
+
+            if key not in self.request_summarizers:
+                self.request_summarizers[key] = self.get_summarizer(
+                    init=False, provider=provider
+                )
+            return self.request_summarizers[key]
+
+    def _get_summary_request(self, text, config):
+        summary_provider = config.get("provider", None)
         summary_persona = config.get("persona", "")
         summary_prompt = config.get("prompt", "")
         summary_format = config.get("output_format", "")
-        summary_endings = ensure_list(config.get("endings", [".", "?", "!"]))
-        summary_retries = config.get("retries", 5)
         summary_config = {
             key: value
             for key, value in config.items()
-            if key not in ["persona", "prompt", "output_format", "retries", "endings"]
+            if key
+            not in [
+                "persona",
+                "prompt",
+                "output_format",
+                "retries",
+                "endings",
+                "stream",
+                "stream_channel",
+            ]
         }
-        summary_id = get_identifier(
-            [text, summary_prompt, summary_persona, summary_format, summary_config]
+        return Collection(
+            provider=summary_provider,
+            channel="agent:model:{}".format(
+                summary_provider if summary_provider else "summary"
+            ),
+            id=get_identifier(
+                [text, summary_prompt, summary_persona, summary_format, summary_config]
+            ),
+            text=text,
+            persona=summary_persona,
+            prompt=summary_prompt,
+            format=summary_format,
+            endings=ensure_list(config.get("endings", [".", "?", "!"])),
+            retries=config.get("retries", 5),
+            config=summary_config,
+        )
+
+    def _start_summary(self, request):
+        summary = self._summary.get_or_create(request.id)
+        summary.text = ensure_list(request.text)
+        summary.persona = request.persona
+        summary.prompt = request.prompt
+        summary.format = request.format
+        summary.endings = request.endings
+        summary.config = request.config
+
+        if self.debug and self.verbosity > 2:
+            self.notice("Generating summary")
+            self.info("\n")
+            self.info(request.text)
+            self.info("\n")
+            self.info(dump_json(request.config, indent=2))
+            self.info("\n")
+            self.info("-" * self.display_width)
+
+        return summary
+
+    def _save_summary(
+        self, summary, response_text, request_tokens, response_tokens, processing_cost
+    ):
+        if self.debug and self.verbosity > 2:
+            self.info("\n")
+            self.info(response_text)
+
+        summary.result = response_text
+        summary.request_tokens = request_tokens
+        summary.response_tokens = response_tokens
+        summary.cost = processing_cost
+        summary.save()
+
+        return Collection(
+            text=response_text,
+            request_tokens=request_tokens,
+            response_tokens=response_tokens,
+            total_tokens=(request_tokens + response_tokens),
+            cost=processing_cost,
+            cached=False,
+        )
+
+    def _get_summary_cache_cutoff(self):
+        cutoffs = []
+
+        if settings.SUMMARIZER_CACHE_TTL:
+            cutoffs.append(
+                timezone.now() - timedelta(seconds=settings.SUMMARIZER_CACHE_TTL)
+            )
+
+        if settings.SUMMARIZER_CACHE_MAX_SIZE:
+            # Summaries are referenced by other models so rows are never deleted,
+            # instead everything older than the newest entries is treated as evicted
+            now = time.time()
+            if (
+                now - MLCommandMixin.summary_cache_checked
+            ) >= self.summary_cache_interval:
+                max_size = settings.SUMMARIZER_CACHE_MAX_SIZE
+                updated = list(
+                    self._summary.filter()
+                    .order_by("-updated")
+                    .values_list("updated", flat=True)[max_size : max_size + 1]
+                )
+                MLCommandMixin.summary_cache_cutoff = updated[0] if updated else None
+                MLCommandMixin.summary_cache_checked = now
+
+            if MLCommandMixin.summary_cache_cutoff:
+                cutoffs.append(MLCommandMixin.summary_cache_cutoff)
+
+        return max(cutoffs) if cutoffs else None
+
+    def _get_shared_summary(self, text):
+        # Reused results were already paid for by the request that produced them
+        return Collection(
+            text=text,
+            request_tokens=0,
+            response_tokens=0,
+            total_tokens=0,
+            cost=0,
+            cached=True,
+        )
+
+    def _get_cached_summary(self, request, cache=True, since=None):
+        summary = self._summary.retrieve(request.id)
+        if (
+            not summary
+            or not summary.result
+            or summary.result == self.summary_failure_message
+        ):
+            return None
+
+        if since and summary.updated and summary.updated >= since:
+            # Completed by another worker while this request waited on the lock
+            if self.debug and self.verbosity > 2:
+                self.notice("Using concurrent summary: {}".format(request.id))
+            return self._get_shared_summary(summary.result)
+
+        if not cache or not settings.SUMMARIZER_CACHE_ENABLED:
+            return None
+
+        cutoff = self._get_summary_cache_cutoff()
+        if cutoff and summary.updated and summary.updated <= cutoff:
+            return None
+
+        if self.debug and self.verbosity > 2:
+            self.notice("Using cached summary: {}".format(request.id))
+
+        return self._get_shared_summary(summary.result)
+
+    def _join_summary_flight(self, request):
+        key = "{}:{}".format(request.channel, request.id)
+
+        with self.summary_flight_lock:
+            flight = self.summary_flights.get(key, None)
+            if flight is None:
+                self.summary_flights[key] = Future()
+                return key, None
+        return key, flight
+
+    def _finish_summary_flight(self, key, result=None, error=None):
+        with self.summary_flight_lock:
+            flight = self.summary_flights.pop(key)
+
+        if error is not None:
+            flight.set_exception(error)
+        else:
+            flight.set_result(result)
+
+    def _run_summary_flight(self, request, generate, on_token=None):
+        key, flight = self._join_summary_flight(request)
+
+        if flight is not None:
+            # Identical request already in flight in this process
+            summary = self._get_shared_summary(flight.result().text)
+            if on_token:
+                on_token(summary.text)
+            return summary
+        try:
+            summary = generate()
+        except BaseException as e:
+            self._finish_summary_flight(key, error=e)
+            raise e
+
+        self._finish_summary_flight(key, summary)
+        return summary
+
+    async def _arun_summary_flight(self, request, generate, on_token=None):
+        key, flight = self._join_summary_flight(request)
+
+        if flight is not None:
+            summary = self._get_shared_summary(
+                (await asyncio.wrap_future(flight)).text
+            )
+            if on_token:
+                on_token(summary.text)
+            return summary
+        try:
+            summary = await generate()
+        except BaseException as e:
+            self._finish_summary_flight(key, error=e)
+            raise e
+
+        self._finish_summary_flight(key, summary)
+        return summary
+
+    async def _arun_exclusive(self, key, generate):
+        # The cross process lock is held from a worker thread while the
+        # coroutine runs on the event loop so other workers still wait on it
+        loop = asyncio.get_running_loop()
+        locked = loop.create_future()
+        finished = threading.Event()
+
+        def hold():
+            loop.call_soon_threadsafe(
+                lambda: locked.done() or locked.set_result(True)
+            )
+            finished.wait()
+
+        lock_task = asyncio.ensure_future(
+            sync_to_async(self.run_exclusive, thread_sensitive=False)(key, hold)
         )
+        try:
+            await asyncio.wait(
+                [locked, lock_task], return_when=asyncio.FIRST_COMPLETED
+            )
+            if lock_task.done():
+                lock_task.result()
+            return await generate()
+        finally:
+            finished.set()
+            await asyncio.wait([lock_task])
+            if not locked.done():
+                locked.cancel()
+
+    def _get_retry_config(self, config, result):
+        # Truncated answers are continued from where they stopped instead of
+        # paying for the full prompt and generation again
+        if (
+            settings.SUMMARIZER_RETRY_MODE == "continue"
+            and result
+            and result.get("finish_reason", None) == "length"
+            and result["text"]
+        ):
+            return {**config, "prefix": result["text"]}
+        return config
+
+    def _get_retry_reset(self, result_config):
+        # Anything but a continuation regenerates from the start so tokens
+        # already streamed for the failed attempt have to be discarded
+        return "prefix" not in result_config
+
+    def _listen_summary_stream(self, request, config, on_token, on_reset=None):
+        stream_channel = "{}:stream:{}".format(request.channel, uuid.uuid4().hex)
+        config["stream"] = True
+        config["stream_channel"] = stream_channel
+        ready = threading.Event()
+
+        def listen():
+            for package in self.listen(
+                stream_channel, timeout=settings.HTTP_REQUEST_TIMEOUT
+            ):
+                if package.message.get("ready", False):
+                    ready.set()
+                elif package.message.get("done", False):
+                    break
+                elif package.message.get("reset", False):
+                    if on_reset:
+                        on_reset()
+                else:
+                    on_token(package.message["text"])
+
+        thread = threading.Thread(target=listen, daemon=True)
+        thread.start()
+
+        # Probes are resent until one arrives so no tokens are published
+        # before the listener is subscribed to the channel
+        start_time = time.time()
+        while (
+            thread.is_alive()
+            and (time.time() - start_time) < settings.HTTP_REQUEST_TIMEOUT
+        ):
+            self.send(stream_channel, {"ready": True})
+            if ready.wait(self.summary_stream_ready_interval):
+                break
+
+        return stream_channel, thread
+
+    def _close_summary_stream(self, stream_channel, thread):
+        self.send(stream_channel, {"done": True})
+        thread.join(timeout=self.summary_stream_join_timeout)
+
+    def generate_summary(
+        self, text, on_token=None, on_reset=None, cache=True, **config
+    ):
+        summarizer = self._get_request_summarizer(config.get("provider", None))
+        request = self._get_summary_request(text, config)
+        request_time = timezone.now()
 
         def generate():
-            summary = self._summary.get_or_create(summary_id)
-            summary.text = ensure_list(text)
-            summary.persona = summary_persona
-            summary.prompt = summary_prompt
-            summary.format = summary_format
-            summary.endings = summary_endings
-            summary.config = summary_config
+            cached_summary = self._get_cached_summary(
+                request, cache=cache, since=request_time
+            )
+            if cached_summary:
+                if on_token:
+                    on_token(cached_summary.text)
+                return cached_summary
+
+            summary = self._start_summary(request)
+            stream_channel = None
 
+            if on_token:
+                stream_channel, stream_thread = self._listen_summary_stream(
+                    request, config, on_token, on_reset
+                )
             request_tokens = 0
             response_tokens = 0
             processing_cost = 0
+            result_config = config
 
-            if self.debug and self.verbosity > 2:
-                self.notice("Generating summary")
-                self.info("\n")
-                self.info(text)
-                self.info("\n")
-                self.info(dump_json(config, indent=2))
-                self.info("\n")
-                self.info("-" * self.display_width)
-
-            for index in range(summary_retries):
-                result = self.submit(summary_channel, {"text": text, "config": config})
+            try:
+                for index in range(request.retries):
+                    result = self.submit(
+                        request.channel, {"text": text, "config": result_config}
+                    )
+                    request_tokens += result["prompt_tokens"]
+                    response_tokens += result["output_tokens"]
+                    processing_cost += result["cost"]
+
+                    if result and check_result(result, request.endings):
+                        response_text = result["text"]
+                        break
+                    else:
+                        response_text = self.summary_failure_message
+                        result_config = self._get_retry_config(config, result)
+
+                        if stream_channel and self._get_retry_reset(result_config):
+                            self.send(stream_channel, {"reset": True})
+            finally:
+                if stream_channel:
+                    self._close_summary_stream(stream_channel, stream_thread)
+
+            return self._save_summary(
+                summary, response_text, request_tokens, response_tokens, processing_cost
+            )
+
+        return self._run_summary_flight(
+            request,
+            lambda: self.run_exclusive(
+                "ml:{}:{}".format(request.channel, request.id), generate
+            ),
+            on_token,
+        )
+
+    async def agenerate_summary(
+        self, text, on_token=None, on_reset=None, cache=True, **config
+    ):
+        summarizer = await sync_to_async(self._get_request_summarizer)(
+            config.get("provider", None)
+        )
+        request = self._get_summary_request(text, config)
+        request_time = timezone.now()
+
+        async def generate():
+            cached_summary = await sync_to_async(self._get_cached_summary)(
+                request, cache=cache, since=request_time
+            )
+            if cached_summary:
+                if on_token:
+                    on_token(cached_summary.text)
+                return cached_summary
+
+            summary = await sync_to_async(self._start_summary)(request)
+
+            request_tokens = 0
+            response_tokens = 0
+            processing_cost = 0
+            result_config = config
+
+            for index in range(request.retries):
+                result = (
+                    await summarizer.asummarize(
+                        text, on_token=on_token, on_reset=on_reset, **result_config
+                    )
+                ).export()
                 request_tokens += result["prompt_tokens"]
                 response_tokens += result["output_tokens"]
                 processing_cost += result["cost"]
 
-                if result and check_ending(result["text"], summary_endings):
+                if result and check_result(result, request.endings):
                     response_text = result["text"]
                     break
                 else:
-                    response_text = "Summary generation was unsuccessful. Please retry with a modified question."
-
-            if self.debug and self.verbosity > 2:
-                self.info("\n")
-                self.info(response_text)
-
-            summary.result = response_text
-            summary.request_tokens = request_tokens
-            summary.response_tokens = response_tokens
-            summary.cost = processing_cost
-            summary.save()
-
-            return Collection(
-                text=response_text,
-                request_tokens=request_tokens,
-                response_tokens=response_tokens,
-                total_tokens=(request_tokens + response_tokens),
-                cost=processing_cost,
+                    response_text = self.summary_failure_message
+                    result_config = self._get_retry_config(config, result)
+
+                    if on_token and on_reset and self._get_retry_reset(result_config):
+                        on_reset()
+
+            return await sync_to_async(self._save_summary)(
+                summary,
+                response_text,
+                request_tokens,
+                response_tokens,
+                processing_cost,
             )
 
-        return self.run_exclusive(
-            "ml:{}:{}".format(summary_channel, summary_id), generate
+        return await self._arun_summary_flight(
+            request,
+            lambda: self._arun_exclusive(
+                "ml:{}:{}".format(request.channel, request.id), generate
+            ),
+            on_token,
         )
 
     def exec_summary(self, provider=None):
@@ -199,7 +655,21 @@ class MLCommandMixin(CommandMixin("ml")):
         summary_channel = "agent:model:{}".format(summary_key)
 
         def parse_model_summary(text, config):
-            return summarizer.summarize(text, **config).export()
+            config = dict(config)
+            stream_channel = config.pop("stream_channel", None)
+
+            def send_token(token):
+                self.send(stream_channel, {"text": token})
+
+            def send_reset():
+                self.send(stream_channel, {"reset": True})
+
+            return summarizer.summarize(
+                text,
+                on_token=send_token if stream_channel else None,
+                on_reset=send_reset if stream_channel else None,
+                **config
+            ).export()
 
         for package in self.listen(
             summary_channel, state_key="model_{}".format(summary_key)
@@ -222,6 +692,9 @@ class MLCommandMixin(CommandMixin("ml")):
                     "provider": summarizer.name,
                     "time": response.time,
                     "memory": response.memory,
+                    "transport": get_transport().stats(),
+                    "concurrency": get_limiter_stats(),
+                    "token_cache": summarizer.get_token_cache_stats(),
                 },
             )
 
@@ -303,21 +776,12 @@ class MLCommandMixin(CommandMixin("ml")):
 
         return self.run_exclusive(name, update)
 
-    def parse_text_sections(self, text, cutoff_section_len=10000):
-        sections = []
-        section = ""
-
-        for text_item in ensure_list(text):
-            for chunk in re.split(r"\n\n+", text_item.strip()):
-                if chunk.strip():
-                    combined_section = "{}\n{}".format(section, chunk).strip()
-                    if len(combined_section) >= cutoff_section_len:
-                        sections.append(combined_section)
-                        section = ""
-                    else:
-                        section = combined_section
-
-        if section:
-            sections.append(section)
+    def parse_text_section_offsets(self, text, cutoff_section_len=10000):
+        return get_section_offsets(text, cutoff_section_len)
 
-        return sections
+    def parse_text_sections(self, text, cutoff_section_len=10000):
+        text = "\n\n".join([text_item.strip() for text_item in ensure_list(text)])
+        return [
+            text[start:end]
+            for start, end in self.parse_text_section_offsets(text, cutoff_section_len)
+        ]
@@ -0,0 +1,91 @@
+from systems.commands.index import Command
+from systems.summary.chunker import TextChunker, split_paragraphs
+from utility.deepinfra_mock import get_sample_text
+
+import statistics
+import time
+
+
+class Chunker(Command("model.benchmark.chunker")):
+
+    prompt = "Summarize the key findings of the provided text."
+
+    def exec(self):
+        summarizer = self.get_summarizer(init=False, provider=self.summary_provider)
+        text = get_sample_text(self.seed, self.paragraphs)
+
+        max_token_count = summarizer.get_chunk_length()
+        prompt_token_count = summarizer.get_prompt_token_count(self.prompt)
+
+        # Token counts are cached per tokenizer so warming the cache keeps the
+        # comparison focused on chunk planning
+        self.info("Warming token cache for {} characters".format(len(text)))
+        summarizer.get_token_counts(self.parse_text_sections(text))
+        summarizer.get_token_counts(split_paragraphs(text))
+
+        def get_chunker(**options):
+            return TextChunker(
+                summarizer,
+                max_token_count,
+                prompt_token_count,
+                command=self,
+                overlap=self.overlap,
+                **options
+            )
+
+        strategies = [
+            (
+                "legacy",
+                lambda: self._get_legacy_chunks(
+                    summarizer, text, max_token_count, prompt_token_count
+                ),
+            ),
+            ("greedy", lambda: get_chunker(boundary="greedy").split(text)),
+            ("content", lambda: get_chunker(boundary="content").split(text)),
+            (
+                "greedy (max {} chunks)".format(self.max_chunks),
+                lambda: get_chunker(
+                    boundary="greedy", max_chunks=self.max_chunks
+                ).split(text),
+            ),
+        ]
+        results = [
+            ["Strategy", "Chunks", "Min (s)", "Mean (s)", "Mean Chunk Tokens"]
+        ]
+        for name, run in strategies:
+            times = []
+            for index in range(self.repeats):
+                start_time = time.perf_counter()
+                chunks = run()
+                times.append(time.perf_counter() - start_time)
+
+            results.append(
+                [
+                    name,
+                    len(chunks),
+                    round(min(times), 4),
+                    round(statistics.mean(times), 4),
+                    int(statistics.mean(summarizer.get_token_counts(chunks))),
+                ]
+            )
+
+        self.table(results)
+        self.data("Token cache", summarizer.get_token_cache_stats())
+
+    def _get_legacy_chunks(self, summarizer, text, max_token_count, prompt_token_count):
+        # Chunk planning prior to the shared chunker, kept as a baseline
+        token_count = prompt_token_count
+        chunks = [""]
+        chunk_index = 0
+
+        for section in self.parse_text_sections(text):
+            tokens = summarizer.get_token_count(section)
+            if (token_count + tokens) > max_token_count:
+                chunk_index += 1
+                chunks.append(section)
+                token_count = prompt_token_count + tokens
+            else:
+                token_count += tokens
+                chunks[chunk_index] = "{}\n\n{}".format(chunks[chunk_index], section)
+
+        return chunks
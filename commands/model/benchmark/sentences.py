@@ -0,0 +1,80 @@
+from systems.commands.index import Command
+from utility.deepinfra_mock import get_sample_text
+
+from collections import Counter
+
+import re
+import statistics
+import time
+
+
+class Sentences(Command("model.benchmark.sentences")):
+
+    def exec(self):
+        text = self.text if self.text else get_sample_text(self.seed, self.paragraphs)
+        sections = self.parse_text_sections(text)
+        config = {"validate": self.validate}
+
+        results = [
+            [
+                "Provider",
+                "Load (s)",
+                "Sentences",
+                "Min (s)",
+                "Mean (s)",
+                "Chars/s",
+                "Precision",
+                "Recall",
+            ]
+        ]
+        reference = None
+        for provider_name in [self.reference_provider, self.sentence_provider]:
+            self.info("Benchmarking {} sentence parser".format(provider_name))
+
+            start_time = time.perf_counter()
+            provider = self.get_sentence_parser(provider=provider_name)
+            load_time = time.perf_counter() - start_time
+
+            times = []
+            for index in range(self.repeats):
+                start_time = time.perf_counter()
+                sentences = [
+                    sentence
+                    for section_sentences in provider.split_many(sections, **config)
+                    for sentence in section_sentences
+                ]
+                times.append(time.perf_counter() - start_time)
+
+            if reference is None:
+                reference = sentences
+            precision, recall = self._get_agreement(sentences, reference)
+
+            results.append(
+                [
+                    provider_name,
+                    round(load_time, 3),
+                    len(sentences),
+                    round(min(times), 4),
+                    round(statistics.mean(times), 4),
+                    int(len(text) / min(times)) if min(times) else 0,
+                    precision,
+                    recall,
+                ]
+            )
+
+        self.table(results)
+
+    def _get_agreement(self, sentences, reference):
+        # Sentences are compared as whitespace normalized multisets so boundary
+        # errors count against both precision and recall
+        def normalize(values):
+            return Counter([re.sub(r"\s+", " ", value).strip() for value in values])
+
+        sentences = normalize(sentences)
+        reference = normalize(reference)
+        matches = sum((sentences & reference).values())
+
+        return (
+            round(matches / sum(sentences.values()), 3) if sentences else 0,
+            round(matches / sum(reference.values()), 3) if reference else 0,
+        )
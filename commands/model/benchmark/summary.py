@@ -0,0 +1,159 @@
+from django.conf import settings
+
+from systems.commands.index import Command
+from systems.summary.base import BaseModelSummarizer
+from systems.summary.stream import StreamSummarizer
+from systems.summary.text import TextSummarizer
+from utility.data import Collection
+from utility.deepinfra_mock import (
+    MockDeepInfraServer,
+    get_percentiles,
+    get_sample_text,
+)
+from utility.transport import run_async
+
+import asyncio
+import time
+
+
+class Summary(Command("model.benchmark.summary")):
+
+    prompt = "Summarize the key findings of the provided text."
+
+    def exec(self):
+        summarizer_types = (
+            ["text", "stream", "model"]
+            if self.summarizer_type == "all"
+            else [self.summarizer_type]
+        )
+        with MockDeepInfraServer(
+            latency_median=self.latency,
+            latency_sigma=self.latency_sigma,
+            error_rate=self.error_rate,
+            throttle_rate=self.throttle_rate,
+            output_tokens=self.output_tokens,
+            no_info_rate=self.no_info_rate,
+            seed=self.seed,
+        ) as server:
+            settings.DEEPINFRA_API_URL = server.url
+            settings.DEEPINFRA_API_KEY = "mock"
+
+            results = [
+                [
+                    "Summarizer",
+                    "Jobs",
+                    "Concurrency",
+                    "Time (s)",
+                    "Jobs/s",
+                    "p50 (s)",
+                    "p90 (s)",
+                    "p99 (s)",
+                    "Request Tokens",
+                    "Response Tokens",
+                    "Reduce Depth",
+                ]
+            ]
+            for summarizer_type in summarizer_types:
+                self.info("Benchmarking {} summarizer".format(summarizer_type))
+                benchmark = run_async(
+                    self._run_benchmark(self._get_jobs(summarizer_type))
+                )
+                percentiles = get_percentiles(benchmark.latencies)
+                results.append(
+                    [
+                        summarizer_type,
+                        self.jobs,
+                        self.concurrency,
+                        round(benchmark.time, 3),
+                        round(self.jobs / benchmark.time, 3),
+                        percentiles["p50"],
+                        percentiles["p90"],
+                        percentiles["p99"],
+                        benchmark.request_tokens,
+                        benchmark.response_tokens,
+                        benchmark.reduce_depth,
+                    ]
+                )
+
+            self.table(results)
+            self.data("Mock inference requests", server.stats())
+
+    def _get_text(self, index):
+        return get_sample_text("{}:{}".format(self.seed, index), self.paragraphs)
+
+    def _get_blocks(self, index, block_size=65536):
+        text = self._get_text(index)
+        for position in range(0, len(text), block_size):
+            yield text[position : position + block_size]
+
+    def _get_jobs(self, summarizer_type):
+        # Summarizers touch the database on construction so they are built
+        # before the event loop starts
+        jobs = []
+
+        if summarizer_type == "text":
+            for index in range(self.jobs):
+                summarizer = TextSummarizer(
+                    self, self._get_text(index), provider=self.summary_provider
+                )
+                jobs.append(
+                    lambda summarizer=summarizer: summarizer.agenerate(
+                        self.prompt,
+                        fan_in=self.fan_in,
+                        concurrency=self.map_concurrency,
+                        cache=False,
+                    )
+                )
+        elif summarizer_type == "stream":
+            for index in range(self.jobs):
+                summarizer = StreamSummarizer(
+                    self, self._get_blocks(index), provider=self.summary_provider
+                )
+                jobs.append(
+                    lambda summarizer=summarizer: summarizer.agenerate(
+                        self.prompt,
+                        fan_in=self.fan_in,
+                        concurrency=self.map_concurrency,
+                        cache=False,
+                    )
+                )
+        else:
+            summarizer = BaseModelSummarizer(
+                self,
+                Collection(id="benchmark", facade=Collection(pk="id")),
+                provider=self.summary_provider,
+            )
+            for index in range(self.jobs):
+                jobs.append(
+                    lambda text=self._get_text(index): summarizer.agenerate(
+                        self.prompt,
+                        text=text,
+                        max_chunks=self.max_chunks,
+                        fan_in=self.fan_in,
+                        concurrency=self.map_concurrency,
+                        cache=False,
+                    )
+                )
+        return jobs
+
+    async def _run_benchmark(self, jobs):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies = []
+
+        async def run_job(job):
+            async with semaphore:
+                start_time = time.time()
+                summary = await job()
+                latencies.append(time.time() - start_time)
+                return summary
+
+        start_time = time.time()
+        summaries = await asyncio.gather(*[run_job(job) for job in jobs])
+
+        return Collection(
+            time=(time.time() - start_time),
+            latencies=latencies,
+            request_tokens=sum([summary.request_tokens for summary in summaries]),
+            response_tokens=sum([summary.response_tokens for summary in summaries]),
+            reduce_depth=max([summary.reduce_depth for summary in summaries]),
+        )
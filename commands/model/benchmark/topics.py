@@ -0,0 +1,66 @@
+from systems.commands.index import Command
+from utility.deepinfra_mock import get_sample_text
+from utility.topics import TopicModel
+
+import statistics
+import time
+
+
+class Topics(Command("model.benchmark.topics")):
+
+    def exec(self):
+        topics = TopicModel()
+        texts = [
+            get_sample_text("{}:{}".format(self.seed, index), self.paragraphs)
+            for index in range(self.documents)
+        ]
+
+        # The first call pays for lazy pipeline setup in the shared model
+        self.info("Warming topic parser for {} documents".format(len(texts)))
+        topics.parse(texts[0] if texts else "", cache=False)
+        baseline = [topics.parse(text, cache=False) for text in texts]
+
+        strategies = [
+            ("parse", lambda: [topics.parse(text, cache=False) for text in texts]),
+            (
+                "parse_many",
+                lambda: topics.parse_many(
+                    texts, batch_size=self.batch_size, n_process=1, cache=False
+                ),
+            ),
+            ("parse (cached)", lambda: [topics.parse(text) for text in texts]),
+        ]
+        if self.processes > 1:
+            strategies.append(
+                (
+                    "parse_many ({} processes)".format(self.processes),
+                    lambda: topics.parse_many(
+                        texts,
+                        batch_size=self.batch_size,
+                        n_process=self.processes,
+                        cache=False,
+                    ),
+                )
+            )
+
+        results = [["Strategy", "Documents", "Min (s)", "Mean (s)", "Docs/s", "Match"]]
+        for name, run in strategies:
+            times = []
+            for index in range(self.repeats):
+                start_time = time.perf_counter()
+                text_topics = run()
+                times.append(time.perf_counter() - start_time)
+
+            results.append(
+                [
+                    name,
+                    len(texts),
+                    round(min(times), 4),
+                    round(statistics.mean(times), 4),
+                    round(len(texts) / min(times), 1) if min(times) else 0,
+                    text_topics == baseline,
+                ]
+            )
+
+        self.table(results)
+        self.data("Topic cache", topics.get_cache_stats())
@@ -6,7 +6,7 @@ class Text(Command('model.summarize.text')):
 
     def exec(self):
         summary = TextSummarizer(self, self.text, provider = 'mixtral_di_7bx8').generate(
-            max_chunks = self.max_chunks,
+            fan_in = self.fan_in,
             persona = self.persona.strip(),
             prompt = self.instruction.strip(),
             temperature = self.temperature,
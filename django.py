@@ -28,10 +28,42 @@ PDF_OCR_DPI = Config.integer('ZIMAGI_PDF_OCR_DPI', 200)
 # ML Configurations
 #
 SENTENCE_PARSER_PROVIDERS = Config.list('ZIMAGI_SENTENCE_PARSER_PROVIDERS', [ 'core_en_web' ])
+# Opt in only: fast providers split differently than the model parsers, so enabling
+# them changes stored sentence order and invalidates existing sentence embeddings
+SENTENCE_PARSER_FAST_PROVIDERS = Config.list('ZIMAGI_SENTENCE_PARSER_FAST_PROVIDERS', [])
+SENTENCE_PARSER_BATCH_SIZE = Config.integer('ZIMAGI_SENTENCE_PARSER_BATCH_SIZE', 32)
+# Opt in only: senter boundaries differ from the dependency parser, so indexed documents
+# need their sentences and embeddings rebuilt after enabling it
+SENTENCE_PARSER_SENTER = Config.boolean('ZIMAGI_SENTENCE_PARSER_SENTER', False)
 ENCODER_PROVIDERS = Config.list('ZIMAGI_ENCODER_PROVIDERS', [ 'mpnet_di' ])
 SUMMARIZER_PROVIDERS = Config.list('ZIMAGI_SUMMARIZER_PROVIDERS', [ 'mixtral_di_7bx8' ])
 
+SPACY_PRELOAD_MODELS = Config.list('ZIMAGI_SPACY_PRELOAD_MODELS', [])
+TOPIC_PARSER_BATCH_SIZE = Config.integer('ZIMAGI_TOPIC_PARSER_BATCH_SIZE', 64)
+TOPIC_PARSER_PROCESSES = Config.integer('ZIMAGI_TOPIC_PARSER_PROCESSES', 1)
+TOPIC_CACHE_SIZE = Config.integer('ZIMAGI_TOPIC_CACHE_SIZE', 10000)
+
 SUMMARIZER_COST_PER_TOKEN = Config.decimal('ZIMAGI_SUMMARIZER_COST_PER_TOKEN', 0.0000003)
+SUMMARIZER_MAP_CONCURRENCY = Config.integer('ZIMAGI_SUMMARIZER_MAP_CONCURRENCY', 20)
+SUMMARIZER_TOKEN_CACHE_SIZE = Config.integer('ZIMAGI_SUMMARIZER_TOKEN_CACHE_SIZE', 100000)
+SUMMARIZER_RETRY_MODE = Config.string('ZIMAGI_SUMMARIZER_RETRY_MODE', 'continue')
+SUMMARIZER_REDUCE_FAN_IN = Config.integer('ZIMAGI_SUMMARIZER_REDUCE_FAN_IN', 8)
+SUMMARIZER_REDUCE_MAX_DEPTH = Config.integer('ZIMAGI_SUMMARIZER_REDUCE_MAX_DEPTH', 10)
+SUMMARIZER_CHUNK_BOUNDARY = Config.string('ZIMAGI_SUMMARIZER_CHUNK_BOUNDARY', 'content')
+SUMMARIZER_CHUNK_OVERLAP = Config.integer('ZIMAGI_SUMMARIZER_CHUNK_OVERLAP', 0)
+SUMMARIZER_SENTENCE_TOKENS_ENABLED = Config.boolean('ZIMAGI_SUMMARIZER_SENTENCE_TOKENS_ENABLED', True)
+
+SUMMARIZER_CACHE_ENABLED = Config.boolean('ZIMAGI_SUMMARIZER_CACHE_ENABLED', True)
+SUMMARIZER_CACHE_TTL = Config.integer('ZIMAGI_SUMMARIZER_CACHE_TTL', 2592000)
+SUMMARIZER_CACHE_MAX_SIZE = Config.integer('ZIMAGI_SUMMARIZER_CACHE_MAX_SIZE', 100000)
+
+#
+# HTTP Transport
+#
+HTTP_POOL_CONNECTIONS = Config.integer('ZIMAGI_HTTP_POOL_CONNECTIONS', 10)
+HTTP_POOL_MAXSIZE = Config.integer('ZIMAGI_HTTP_POOL_MAXSIZE', 50)
+HTTP_CONNECT_TIMEOUT = Config.integer('ZIMAGI_HTTP_CONNECT_TIMEOUT', 30)
+HTTP_REQUEST_TIMEOUT = Config.integer('ZIMAGI_HTTP_REQUEST_TIMEOUT', 600)
 
 #
 # HuggingFace Account
@@ -42,6 +74,16 @@ HUGGINGFACE_TOKEN = Config.string('ZIMAGI_HUGGINGFACE_TOKEN')
 # DeepInfra Account
 #
 DEEPINFRA_API_KEY = Config.string('ZIMAGI_DEEPINFRA_API_KEY')
+DEEPINFRA_API_URL = Config.string('ZIMAGI_DEEPINFRA_API_URL', 'https://api.deepinfra.com')
+
+DEEPINFRA_CONCURRENCY_INITIAL = Config.integer('ZIMAGI_DEEPINFRA_CONCURRENCY_INITIAL', 8)
+DEEPINFRA_CONCURRENCY_MIN = Config.integer('ZIMAGI_DEEPINFRA_CONCURRENCY_MIN', 1)
+DEEPINFRA_CONCURRENCY_MAX = Config.integer('ZIMAGI_DEEPINFRA_CONCURRENCY_MAX', 64)
+DEEPINFRA_LATENCY_TOLERANCE = Config.decimal('ZIMAGI_DEEPINFRA_LATENCY_TOLERANCE', 2.0)
+
+DEEPINFRA_MAX_RETRIES = Config.integer('ZIMAGI_DEEPINFRA_MAX_RETRIES', 8)
+DEEPINFRA_RETRY_WAIT = Config.integer('ZIMAGI_DEEPINFRA_RETRY_WAIT', 1)
+DEEPINFRA_RETRY_MAX_WAIT = Config.integer('ZIMAGI_DEEPINFRA_RETRY_MAX_WAIT', 120)
 
 #
 # Google Cloud Configurations
@@ -1,10 +1,9 @@
 from django.conf import settings
 
 from systems.plugins.index import BaseProvider
+from utility.concurrency import run_limited
 from utility.data import load_json
-
-import requests
-import time
+from utility.transport import get_transport
 
 
 class DeepInfraRequestError(Exception):
@@ -19,38 +18,29 @@ class Provider(BaseProvider('encoder', 'di')):
 
 
     def _run_inference(self, **config):
-        wait_sec = 1
-
-        while True:
-            try:
-                response = requests.post(
-                    "https://api.deepinfra.com/v1/inference/sentence-transformers/{}".format(self._get_model_name()),
-                    headers = {
-                        'Authorization': "bearer {}".format(settings.DEEPINFRA_API_KEY),
-                        'Content-Type': 'application/json'
-                    },
-                    timeout = 2000,
-                    json = config
-                )
-                try:
-                    response_data = load_json(response.text)
-                    break
-
-                except Exception as e:
-                    self.command.warning("Invalid JSON returned: {}".format(response.text))
-
-            except requests.exceptions.ConnectionError as e:
-                self.command.warning(str(e))
-
-            wait_sec = min((wait_sec * 2), 300)
-            time.sleep(wait_sec)
-
-        if response.status_code == 200 and response_data['embeddings']:
+        url = "{}/v1/inference/sentence-transformers/{}".format(settings.DEEPINFRA_API_URL, self._get_model_name())
+        request = {
+            'headers': {
+                'Authorization': "bearer {}".format(settings.DEEPINFRA_API_KEY),
+                'Content-Type': 'application/json'
+            },
+            'timeout': 2000,
+            'json': config
+        }
+
+        # Throttles and connection errors are retried by run_limited
+        response = run_limited(url, lambda: get_transport().post(url, **request))
+        try:
+            response_data = load_json(response.text)
+        except Exception as e:
+            response_data = None
+
+        if response.status_code == 200 and isinstance(response_data, dict) and response_data.get('embeddings', None):
             return response_data['embeddings']
         else:
             raise DeepInfraRequestError("DeepInfra inference request failed with code {}: {}".format(
                 response.status_code,
-                response_data
+                response_data if response_data is not None else response.text
             ))
 
 
@@ -33,3 +33,7 @@ class BaseProvider(BasePlugin('sentence_parser')):
 
     def split(self, text, **config):
         raise NotImplementedError("Class split method required by all subclasses")
+
+    def split_many(self, texts, **config):
+        # Override in sub providers that support batched parsing
+        return [ self.split(text, **config) for text in texts ]
@@ -0,0 +1,75 @@
+from systems.plugins.index import BaseProvider
+
+import re
+
+
+class Provider(BaseProvider('sentence_parser', 'rule')):
+
+    abbreviations = set([
+        'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'ft', 'gen', 'gov', 'sen', 'rep', 'rev', 'hon', 'capt', 'col', 'lt', 'sgt',
+        'vs', 'etc', 'al', 'cf', 'approx', 'dept', 'est', 'inc', 'ltd', 'co', 'corp', 'nos', 'vol', 'fig', 'figs', 'eq', 'pp', 'ed', 'eds',
+        'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+        'e.g', 'i.e', 'u.s', 'u.k', 'u.n', 'a.m', 'p.m', 'ph.d', 'b.a', 'm.a', 'b.s', 'm.s'
+    ])
+
+    boundary_pattern = re.compile(r'(?P<mark>[.!?]+[\'"\)\]]*)(?=\s)\s*|\n[ \t]*\n\s*')
+    paragraph_pattern = re.compile(r'\n[ \t]*\n')
+    word_end_pattern = re.compile(r'(\S+)$')
+    title_pattern = re.compile(r'^[\'"\(\[]?[A-Z]')
+    word_pattern = re.compile(r'[A-Za-z]+')
+
+
+    @classmethod
+    def initialize(cls, instance, init):
+        # Rules are compiled with the class so there is no model to load
+        pass
+
+
+    def _is_boundary(self, text, match):
+        mark = match.group('mark')
+        if not mark or '!' in mark or '?' in mark or self.paragraph_pattern.search(match.group(0)):
+            return True
+
+        word = self.word_end_pattern.search(text, max(0, match.start() - 40), match.start())
+        word = word.group(1).lstrip('\'"([').lower() if word else ''
+        if word in self.abbreviations or (len(word) == 1 and word.isalpha()):
+            return False
+
+        # Periods followed by lower case text continue the sentence
+        return not text[match.end():match.end() + 1].islower()
+
+    def _get_sentences(self, text):
+        sentences = []
+        start = 0
+
+        for match in self.boundary_pattern.finditer(text):
+            if self._is_boundary(text, match):
+                sentence = text[start:match.end()].strip()
+                if sentence:
+                    sentences.append(sentence)
+                start = match.end()
+
+        sentence = text[start:].strip()
+        if sentence:
+            sentences.append(sentence)
+        return sentences
+
+    def _is_valid(self, sentence):
+        # Without part of speech tags validation approximates the noun and verb
+        # check with a title cased start, several words and a terminal mark
+        return bool(self.title_pattern.match(sentence)) \
+            and len(self.word_pattern.findall(sentence)) >= 3 \
+            and sentence.rstrip('\'")]')[-1:] in ('.', '!', '?')
+
+
+    def split(self, text, **config):
+        sentences = self._get_sentences(text.strip())
+
+        if config.get('validate', True):
+            sentences = [
+                re.sub(r'\n+', ' ', sentence).strip()
+                for sentence in sentences
+                if self._is_valid(sentence)
+            ]
+            sentences = [ sentence for sentence in sentences if len(sentence) < self.get_max_sentence_length() ]
+        return sentences
@@ -1,14 +1,24 @@
 from django.conf import settings
+from spacy.attrs import POS
+from spacy.symbols import NOUN, PROPN, VERB
 
 from systems.plugins.index import BaseProvider
 from utility.data import get_identifier
+from utility.nlp import get_spacy_model
 
-import spacy
+import numpy
 import re
 
 
 class Provider(BaseProvider('sentence_parser', 'spacy')):
 
+    char_limit = 1000000
+
+    validate_components = [ 'tok2vec', 'tagger', 'attribute_ruler', 'parser' ]
+    split_components = [ 'tok2vec', 'parser' ]
+    noun_pos = numpy.array([ NOUN, PROPN ], dtype = numpy.uint64)
+
+
     @classmethod
     def initialize(cls, instance, init):
         if not getattr(cls, '_model', None):
@@ -19,7 +29,7 @@ class Provider(BaseProvider('sentence_parser', 'spacy')):
 
     @classmethod
     def _get_model(cls, instance):
-        return spacy.load(instance.field_model)
+        return get_spacy_model(instance.field_model)
 
     def _get_identifier(self, init):
         return get_identifier([ super()._get_identifier(init), self.field_model ])
@@ -30,41 +40,77 @@ class Provider(BaseProvider('sentence_parser', 'spacy')):
         return self._model[self.identifier]
 
 
+    def _get_disabled(self, components):
+        return [ name for name in self.model.pipe_names if name not in components ]
+
+    def _get_segments(self, text):
+        segments = []
+        while len(text) > self.char_limit:
+            sentence_index = None
+            for match in re.finditer(r'([^\.]\.|\?|\!)(?=\s+)', text[:self.char_limit], re.MULTILINE):
+                sentence_index = match.end()
+            sentence_index = sentence_index if sentence_index else self.char_limit
+
+            segments.append(text[:sentence_index].strip())
+            text = text[sentence_index:].strip()
+
+        segments.append(text)
+        return segments
+
+    def _parse_docs(self, segments, validate):
+        batch_size = settings.SENTENCE_PARSER_BATCH_SIZE
+
+        if validate:
+            # Validation only reads part of speech tags and sentence boundaries
+            return self.model.pipe(segments,
+                batch_size = batch_size,
+                disable = self._get_disabled(self.validate_components)
+            )
+        if settings.SENTENCE_PARSER_SENTER and 'senter' in self.model.component_names:
+            # The standalone sentence recognizer skips tagging and parsing entirely
+            # but places boundaries differently than the parser used for indexes
+            return self.model.get_pipe('senter').pipe(
+                ( self.model.make_doc(segment) for segment in segments ),
+                batch_size = batch_size
+            )
+        return self.model.pipe(segments,
+            batch_size = batch_size,
+            disable = self._get_disabled(self.split_components)
+        )
+
+    def _get_valid_sentences(self, doc):
+        pos = doc.to_array(POS)
+        sentences = []
+
+        for sentence in doc.sents:
+            if sentence[0].is_title:
+                sentence_pos = pos[sentence.start:sentence.end]
+
+                if numpy.isin(sentence_pos, self.noun_pos).any() and (sentence_pos == VERB).any():
+                    sentence = re.sub(r'\n+', ' ', str(sentence)).strip()
+                    if len(sentence) < self.get_max_sentence_length():
+                        sentences.append(sentence)
+        return sentences
+
+
     def split(self, text, **config):
-        char_limit = 1000000
-
-        def _get_sentences(inner_text):
-            if len(inner_text) > char_limit:
-                sentence_index = None
-                for match in re.finditer(r'([^\.]\.|\?|\!)(?=\s+)', inner_text[:char_limit], re.MULTILINE):
-                    sentence_index = match.end()
-                sentence_index = sentence_index if sentence_index else char_limit
-
-                sentences = [
-                    *_get_sentences(inner_text[:sentence_index].strip()),
-                    *_get_sentences(inner_text[sentence_index:].strip())
-                ]
+        return self.split_many([ text ], **config)[0]
+
+    def split_many(self, texts, **config):
+        validate = config.get('validate', True)
+        text_sentences = [ [] for text in texts ]
+        text_indexes = []
+        segments = []
+
+        for text_index, text in enumerate(texts):
+            for segment in self._get_segments(text.strip()):
+                text_indexes.append(text_index)
+                segments.append(segment)
+
+        for text_index, doc in zip(text_indexes, self._parse_docs(segments, validate)):
+            if validate:
+                text_sentences[text_index].extend(self._get_valid_sentences(doc))
             else:
-                doc = self.model(inner_text)
-                sentences = []
-
-                for sentence in doc.sents:
-                    if config.get('validate', True):
-                        if sentence[0].is_title:
-                            noun_count = 0
-                            verb_count = 0
-
-                            for token in sentence:
-                                if token.pos_ in [ 'NOUN', 'PROPN' ]:
-                                    noun_count += 1
-                                elif token.pos_ == 'VERB':
-                                    verb_count += 1
-
-                            if noun_count > 0 and verb_count > 0:
-                                sentence = re.sub(r'\n+', ' ', str(sentence)).strip()
-                                if len(sentence) < self.get_max_sentence_length():
-                                    sentences.append(str(sentence))
-                    else:
-                        sentences.append(str(sentence))
-            return sentences
-        return _get_sentences(text.strip())
+                text_sentences[text_index].extend([ str(sentence) for sentence in doc.sents ])
+
+        return text_sentences
@@ -1,18 +1,26 @@
+from django.conf import settings
+
 from systems.plugins.index import BasePlugin
-from utility.data import get_identifier, dump_json
+from utility.cache import LRUCache, get_hash_key
+from utility.data import get_identifier, dump_json, ensure_list
 
+import asyncio
 import copy
+import numpy
 import billiard as multiprocessing
 
 
 class SummaryResult(object):
 
-    def __init__(self, text, prompt_tokens, output_tokens, cost=None):
+    def __init__(
+        self, text, prompt_tokens, output_tokens, cost=None, finish_reason=None
+    ):
         self.text = text
         self.prompt_tokens = prompt_tokens
         self.output_tokens = output_tokens
         self.total_tokens = prompt_tokens + output_tokens
         self.cost = cost
+        self.finish_reason = finish_reason
 
     def __str__(self):
         return dump_json(self.__dict__, indent=2)
@@ -27,6 +35,7 @@ class SummaryResult(object):
 class BaseProvider(BasePlugin("summarizer")):
 
     lock = multiprocessing.Lock()
+    token_caches = {}
 
     def __init__(self, type, name, command, init=True, **options):
         super().__init__(type, name, command)
@@ -54,11 +63,70 @@ class BaseProvider(BasePlugin("summarizer")):
             "Class get_chunk_length method required by all subclasses"
         )
 
+    def get_tokenizer_name(self):
+        return self.name
+
+    @property
+    def token_cache(self):
+        tokenizer_name = self.get_tokenizer_name()
+        if tokenizer_name not in self.token_caches:
+            self.token_caches.setdefault(
+                tokenizer_name, LRUCache(settings.SUMMARIZER_TOKEN_CACHE_SIZE)
+            )
+        return self.token_caches[tokenizer_name]
+
+    def get_token_cache_stats(self):
+        return self.token_cache.stats()
+
     def get_token_count(self, text):
+        if isinstance(text, (list, tuple)):
+            return sum([self.get_token_count(section) for section in text])
+        if not text or not text.strip():
+            return 0
+
+        key = get_hash_key(text)
+        token_count = self.token_cache.get(key)
+
+        if token_count is None:
+            token_count = self._get_token_count(text)
+            self.token_cache.set(key, token_count)
+        return token_count
+
+    def _get_token_count(self, text):
         raise NotImplementedError(
-            "Class get_token_count method required by all subclasses"
+            "Class _get_token_count method required by all subclasses"
         )
 
+    def get_token_counts(self, texts):
+        texts = list(texts)
+        token_counts = numpy.zeros(len(texts), dtype=numpy.int64)
+        missing = {}
+
+        for index, text in enumerate(texts):
+            if text and text.strip():
+                key = get_hash_key(text)
+                token_count = self.token_cache.get(key)
+
+                if token_count is None:
+                    missing.setdefault(key, (text, []))[1].append(index)
+                else:
+                    token_counts[index] = token_count
+
+        if missing:
+            missing_info = list(missing.items())
+            for (key, (text, indexes)), token_count in zip(
+                missing_info,
+                self._get_token_counts([info[1][0] for info in missing_info]),
+            ):
+                self.token_cache.set(key, int(token_count))
+                token_counts[indexes] = token_count
+
+        return token_counts
+
+    def _get_token_counts(self, texts):
+        # Override in sub providers that support batched tokenization
+        return [self._get_token_count(text) for text in texts]
+
     def _get_prompt(self, text="", prompt="", persona="", output_format=""):
         raise NotImplementedError("Class _get_prompt method required by all subclasses")
 
@@ -75,3 +143,7 @@ class BaseProvider(BasePlugin("summarizer")):
 
     def summarize(self, text, **config):
         raise NotImplementedError("Class summarize method required by all subclasses")
+
+    async def asummarize(self, text, **config):
+        # Override in sub providers that implement native asynchronous inference
+        return await asyncio.to_thread(self.summarize, text, **config)
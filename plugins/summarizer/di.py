@@ -2,12 +2,19 @@ from django.conf import settings
 
 from plugins.summarizer.base import SummaryResult
 from systems.plugins.index import BaseProvider
+from utility.cache import LRUCache
+from utility.concurrency import (
+    alimited_response,
+    arun_limited,
+    limited_response,
+    run_limited,
+)
 from utility.data import ensure_list, load_json
 from utility.runtime import Runtime
+from utility.transport import get_transport, get_async_transport
 
 import os
 import math
-import requests
 import re
 
 
@@ -15,8 +22,180 @@ class DeepInfraRequestError(Exception):
     pass
 
 
+class SummaryStream(object):
+
+    repetition_check_interval = 64
+    repetition_max_period = 50
+    repetition_min_count = 4
+    repetition_min_words = 12
+
+    def __init__(self, on_token=None, on_reset=None, stop_sentinel=None, prefix=""):
+        self.on_token = on_token
+        self.on_reset = on_reset
+        self.prefix = prefix
+        self.stop_sentinels = ensure_list(stop_sentinel) if stop_sentinel else []
+        self.sentinel_length = max(
+            [len(sentinel) for sentinel in self.stop_sentinels], default=0
+        )
+
+        self.tokens = []
+        self.length = 0
+        self.check_length = 0
+
+        self.usage = None
+        self.finish_reason = None
+        self.stop_reason = None
+
+    @property
+    def text(self):
+        return "".join(self.tokens)
+
+    def parse(self, line):
+        line = line.strip()
+        if not line.startswith("data:"):
+            return True
+
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return False
+
+        event = load_json(data)
+        if event.get("usage", None):
+            self.usage = event["usage"]
+
+        for choice in event.get("choices", []):
+            token = (choice.get("delta", None) or {}).get("content", None)
+            if token:
+                self._add_token(token)
+            if choice.get("finish_reason", None):
+                self.finish_reason = choice["finish_reason"]
+
+        return not self.stop_reason
+
+    def _add_token(self, token):
+        self.tokens.append(token)
+        self.length += len(token)
+
+        if self.on_token:
+            self.on_token(token)
+
+        if self.stop_sentinels and self.length <= (self.sentinel_length * 2):
+            text = self.text.lstrip()
+            for sentinel in self.stop_sentinels:
+                if text.startswith(sentinel):
+                    self.stop_reason = "sentinel"
+
+        if (self.length - self.check_length) >= self.repetition_check_interval:
+            self.check_length = self.length
+            self._check_repetition()
+
+    def _check_repetition(self):
+        text = self.text
+        words = text[-4000:].split()
+
+        for period in range(1, self.repetition_max_period + 1):
+            count = max(
+                self.repetition_min_count,
+                math.ceil(self.repetition_min_words / period),
+            )
+            length = period * count
+
+            if len(words) < length:
+                break
+
+            block = words[-period:]
+            if words[-length:] == block * count:
+                # Keep the first occurrence and drop the degenerate loop
+                match = re.search(
+                    r"(?:\s*{}){{{}}}\s*$".format(
+                        r"\s+".join([re.escape(word) for word in block]), count - 1
+                    ),
+                    text,
+                )
+                if match:
+                    self.tokens = [text[: match.start()]]
+                    self.length = match.start()
+                    self._reset_tokens()
+
+                self.stop_reason = "repetition"
+                return
+
+
+    def _reset_tokens(self):
+        # Forwarded tokens already include the dropped loop so consumers are
+        # reset and sent the kept text, including any continued prefix
+        if self.on_token and self.on_reset:
+            self.on_reset()
+            self.on_token("{}{}".format(self.prefix, self.text))
+
+
+class PromptSkeleton(object):
+
+    default_persona = "You always produce factually correct information from any information given and you do not ask questions."
+
+    def __init__(self, provider, persona="", output_format=""):
+        self.head = []
+        self.tail = []
+
+        if not persona:
+            persona = self.default_persona
+
+        system_prompt = "Use the following description as a persona for all instructions and questions: {}".format(
+            persona.strip()
+        )
+        if provider.implements_system_prompt():
+            self.head.append({"role": "system", "content": system_prompt})
+        else:
+            self.head.extend(
+                [
+                    {"role": "user", "content": system_prompt},
+                    {
+                        "role": "assistant",
+                        "content": "I will use the provided persona when responding to instructions and answering questions.",
+                    },
+                ]
+            )
+
+        if output_format:
+            self.tail.extend(
+                [
+                    {
+                        "role": "user",
+                        "content": "Render all responses according to the following output format instructions: {}".format(
+                            output_format.strip()
+                        ),
+                    },
+                    {
+                        "role": "assistant",
+                        "content": "I will render all following responses according to the output format instructions provided.",
+                    },
+                ]
+            )
+
+        message_tokens = [
+            provider.get_token_count(message["content"])
+            for message in [*self.head, *self.tail]
+        ]
+        self.tokens = sum(message_tokens)
+        self.padded_tokens = self.tokens + (
+            len(message_tokens) * provider.prompt_token_padding
+        )
+
+    def render(self, sections, prompt):
+        return [
+            *self.head,
+            *sections,
+            *self.tail,
+            {"role": "user", "content": prompt},
+        ]
+
+
 class Provider(BaseProvider("summarizer", "di")):
 
+    prompt_token_padding = 10
+    continuation_prompt = "Continue your previous response exactly where it stopped. Do not repeat any of the text that has already been written."
+    prompt_skeletons = LRUCache(1000)
+
     @classmethod
     def initialize(cls, instance, init):
         if not getattr(cls, "_tokenizer", None):
@@ -44,56 +223,28 @@ class Provider(BaseProvider("summarizer", "di")):
         # Override in sub providers if needed
         return True
 
-    def _get_prompt(self, text="", prompt="", persona="", output_format=""):
-        max_context = self.get_max_context()
-        prompt_tokens = self.get_token_count(prompt)
-        sections = []
-        messages = []
-        format_messages = []
-
-        if output_format:
-            format_instruction = "Render all responses according to the following output format instructions: {}".format(
-                output_format.strip()
-            )
-            format_response = "I will render all following responses according to the output format instructions provided."
-            format_messages = [
-                {
-                    "role": "user",
-                    "content": format_instruction,
-                },
-                {
-                    "role": "assistant",
-                    "content": format_response,
-                },
-            ]
-            prompt_tokens += self.get_token_count(
-                format_instruction
-            ) + self.get_token_count(format_response)
+    def get_prompt_skeleton(self, persona="", output_format=""):
+        key = (self.name, persona, output_format)
+        skeleton = self.prompt_skeletons.get(key)
 
-        if not persona:
-            persona = "You always produce factually correct information from any information given and you do not ask questions."
+        if skeleton is None:
+            skeleton = PromptSkeleton(self, persona, output_format)
+            self.prompt_skeletons.set(key, skeleton)
+        return skeleton
 
-        system_prompt = "Use the following description as a persona for all instructions and questions: {}".format(
-            persona.strip()
-        )
-        prompt_tokens += self.get_token_count(system_prompt)
+    def _get_prompt(self, text="", prompt="", persona="", output_format="", prefix=""):
+        skeleton = self.get_prompt_skeleton(persona, output_format)
+        max_context = self.get_max_context()
+        prompt_tokens = skeleton.tokens + self.get_token_count(prompt)
 
-        if self.implements_system_prompt():
-            messages.append({"role": "system", "content": system_prompt})
-        else:
-            system_response = "I will use the provided persona when responding to instructions and answering questions."
-            messages.extend(
-                [
-                    {"role": "user", "content": system_prompt},
-                    {
-                        "role": "assistant",
-                        "content": system_response,
-                    },
-                ]
-            )
-            prompt_tokens += self.get_token_count(system_response)
+        if prefix:
+            prompt_tokens += self.get_token_count([prefix, self.continuation_prompt])
+        sections = []
 
         if text:
+            section_response = "I will reference the provided information when given instructions and answering questions."
+            section_response_tokens = self.get_token_count(section_response)
+
             for section in reversed(ensure_list(text)):
                 if isinstance(section, dict):
                     temp_prompt_tokens = self.get_token_count(section["content"])
@@ -107,92 +258,279 @@ class Provider(BaseProvider("summarizer", "di")):
                     section_prompt = "Reference the following text passage for processing instructions and answering questions: {}".format(
                         section.strip()
                     )
-                    section_response = "I will reference the provided information when given instructions and answering questions."
-
-                    temp_prompt_tokens = self.get_token_count(
-                        section_prompt
-                    ) + self.get_token_count(section_response)
+                    temp_prompt_tokens = (
+                        self.get_token_count(section_prompt) + section_response_tokens
+                    )
 
                     if (temp_prompt_tokens + prompt_tokens) > max_context:
                         break
                     else:
                         sections.extend(
                             [
-                                {
-                                    "role": "user",
-                                    "content": section_prompt,
-                                },
                                 {
                                     "role": "assistant",
                                     "content": section_response,
                                 },
+                                {
+                                    "role": "user",
+                                    "content": section_prompt,
+                                },
                             ]
                         )
                         prompt_tokens += temp_prompt_tokens
 
-        messages.extend(reversed(sections))
-
-        if output_format:
-            messages.extend(format_messages)
-
-        messages.append({"role": "user", "content": prompt})
+        messages = skeleton.render(reversed(sections), prompt)
+        if prefix:
+            # Continuations resend the truncated answer and only ask for the rest
+            messages.extend(
+                [
+                    {"role": "assistant", "content": prefix},
+                    {"role": "user", "content": self.continuation_prompt},
+                ]
+            )
         return messages
 
-    def get_prompt_token_count(self, prompt="", persona="", output_format=""):
-        token_count = 0
-        token_padding = 10
-
-        for message in ensure_list(
-            self._get_prompt("", prompt, persona, output_format)
+    def _merge_prefix(self, prefix, text):
+        if not prefix:
+            return text.strip()
+        if text and not (
+            prefix[-1].isspace() or text[0].isspace() or text[0] in ".,;:!?)]}"
         ):
-            if isinstance(message, dict):
-                token_count += self.get_token_count(message["content"]) + token_padding
-            else:
-                token_count += self.get_token_count(message) + token_padding
+            prefix = "{} ".format(prefix)
+        return "{}{}".format(prefix, text).strip()
+
+    def get_prompt_token_count(self, prompt="", persona="", output_format=""):
+        skeleton = self.get_prompt_skeleton(persona, output_format)
+        return (
+            skeleton.padded_tokens
+            + self.get_token_count(prompt)
+            + self.prompt_token_padding
+        )
 
-        return token_count
+    def _get_inference_url(self):
+        return "{}/v1/openai/chat/completions".format(settings.DEEPINFRA_API_URL)
 
-    def _run_inference(self, messages, **config):
-        response = requests.post(
-            "https://api.deepinfra.com/v1/openai/chat/completions",
-            headers={
+    def _get_inference_request(self, messages, **config):
+        return {
+            "headers": {
                 "Authorization": "Bearer {}".format(settings.DEEPINFRA_API_KEY),
                 "Content-Type": "application/json",
             },
-            timeout=600,
-            json={**config, "messages": messages, "model": self._get_model_name()},
-        )
-        response_data = load_json(response.text)
+            "json": {**config, "messages": messages, "model": self._get_model_name()},
+        }
 
-        if response.status_code == 200 and len(response_data["choices"]):
+    def _parse_inference_response(self, status_code, text):
+        response_data = load_json(text)
+
+        if status_code == 200 and len(response_data["choices"]):
             return response_data
         else:
             raise DeepInfraRequestError(
                 "DeepInfra inference request failed with code {}: {}".format(
-                    response.status_code, response_data
+                    status_code, response_data
                 )
             )
 
-    def summarize(self, text="", prompt="", persona="", output_format="", **config):
-        model_name = self._get_model_name()
+    def _run_inference(self, messages, **config):
+        url = self._get_inference_url()
+        request = self._get_inference_request(messages, **config)
+
+        response = run_limited(url, lambda: get_transport().post(url, **request))
+        return self._parse_inference_response(response.status_code, response.text)
+
+    async def _arun_inference(self, messages, **config):
+        url = self._get_inference_url()
+        request = self._get_inference_request(messages, **config)
+
+        response = await arun_limited(
+            url, lambda: get_async_transport().post(url, **request)
+        )
+        return self._parse_inference_response(response.status_code, response.text)
+
+    def _run_stream_inference(self, messages, stream, **config):
+        url = self._get_inference_url()
+        request = self._get_inference_request(
+            messages, **self._get_stream_config(config)
+        )
+
+        with limited_response(
+            url, lambda: get_transport().post(url, stream=True, **request)
+        ) as response:
+            try:
+                if response.status_code != 200:
+                    self._parse_inference_response(
+                        response.status_code, response.text
+                    )
+
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and not stream.parse(line):
+                        break
+            finally:
+                response.close()
+
+        return stream
+
+    async def _arun_stream_inference(self, messages, stream, **config):
+        url = self._get_inference_url()
+        request = self._get_inference_request(
+            messages, **self._get_stream_config(config)
+        )
+
+        async with alimited_response(
+            url, lambda: get_async_transport().open("POST", url, **request)
+        ) as response:
+            try:
+                if response.status_code != 200:
+                    self._parse_inference_response(
+                        response.status_code, await response.text()
+                    )
+
+                async for line in response.iter_lines():
+                    if line.strip() and not stream.parse(line):
+                        break
+            finally:
+                response.close()
+
+        return stream
+
+    def _get_stream_config(self, config):
+        return {**config, "stream": True, "stream_options": {"include_usage": True}}
+
+    def _get_summary_stream(self, config, on_token, on_reset=None, prefix=""):
+        stream = config.pop("stream", False)
+        stop_sentinel = config.pop("stop_sentinel", None)
+
+        if stream or on_token or stop_sentinel:
+            return SummaryStream(
+                on_token=on_token,
+                on_reset=on_reset,
+                stop_sentinel=stop_sentinel,
+                prefix=prefix,
+            )
+        return None
+
+    def _get_stream_result(self, messages, stream, prefix=""):
+        text = stream.text.strip()
+
+        if stream.usage and not stream.stop_reason:
+            prompt_tokens = stream.usage["prompt_tokens"]
+            output_tokens = stream.usage["completion_tokens"]
+            cost = stream.usage.get("estimated_cost", None)
+        else:
+            # Usage is only reported when the stream runs to completion
+            prompt_tokens = sum(
+                [self.get_token_count(message["content"]) for message in messages]
+            )
+            output_tokens = self.get_token_count(text)
+            cost = None
+
+        text = self._merge_prefix(prefix, stream.text)
+
+        if cost is None:
+            cost = (prompt_tokens + output_tokens) * float(
+                settings.SUMMARIZER_COST_PER_TOKEN
+            )
+
+        if self.command.debug:
+            self.command.data(
+                "DeepInfra {} stream".format(self._get_model_name()),
+                {
+                    "usage": stream.usage,
+                    "finish_reason": stream.finish_reason,
+                    "stop_reason": stream.stop_reason,
+                },
+            )
+
+        return SummaryResult(
+            text=text,
+            prompt_tokens=prompt_tokens,
+            output_tokens=output_tokens,
+            cost=cost,
+            finish_reason=(
+                stream.stop_reason if stream.stop_reason else stream.finish_reason
+            ),
+        )
+
+    def _get_summary_request(
+        self, text, prompt, persona, output_format, prefix, config
+    ):
         messages = self._get_prompt(
-            text, prompt=prompt, persona=persona, output_format=output_format
+            text,
+            prompt=prompt,
+            persona=persona,
+            output_format=output_format,
+            prefix=prefix,
         )
         if self.command.debug:
-            self.command.data("DeepInfra {} prompt".format(model_name), messages)
+            self.command.data(
+                "DeepInfra {} prompt".format(self._get_model_name()), messages
+            )
 
         if re.search(r"\s*(JSON|json)\s*", output_format):
             config["response_format"] = {"type": "json_object"}
 
-        results = self._run_inference(
-            messages, max_tokens=self.get_max_new_tokens(), **config
-        )
+        return messages, {"max_tokens": self.get_max_new_tokens(), **config}
+
+    def _get_summary_result(self, results, prefix=""):
         if self.command.debug:
-            self.command.data("DeepInfra {} results".format(model_name), results)
+            self.command.data(
+                "DeepInfra {} results".format(self._get_model_name()), results
+            )
 
         return SummaryResult(
-            text=results["choices"][0]["message"]["content"].strip(),
+            text=self._merge_prefix(
+                prefix, results["choices"][0]["message"]["content"]
+            ),
             prompt_tokens=results["usage"]["prompt_tokens"],
             output_tokens=results["usage"]["completion_tokens"],
             cost=results["usage"]["estimated_cost"],
+            finish_reason=results["choices"][0].get("finish_reason", None),
+        )
+
+    def summarize(
+        self,
+        text="",
+        prompt="",
+        persona="",
+        output_format="",
+        prefix="",
+        on_token=None,
+        on_reset=None,
+        **config
+    ):
+        stream = self._get_summary_stream(config, on_token, on_reset, prefix)
+        messages, config = self._get_summary_request(
+            text, prompt, persona, output_format, prefix, config
+        )
+        if stream:
+            return self._get_stream_result(
+                messages,
+                self._run_stream_inference(messages, stream, **config),
+                prefix,
+            )
+        return self._get_summary_result(self._run_inference(messages, **config), prefix)
+
+    async def asummarize(
+        self,
+        text="",
+        prompt="",
+        persona="",
+        output_format="",
+        prefix="",
+        on_token=None,
+        on_reset=None,
+        **config
+    ):
+        stream = self._get_summary_stream(config, on_token, on_reset, prefix)
+        messages, config = self._get_summary_request(
+            text, prompt, persona, output_format, prefix, config
+        )
+        if stream:
+            return self._get_stream_result(
+                messages,
+                await self._arun_stream_inference(messages, stream, **config),
+                prefix,
+            )
+        return self._get_summary_result(
+            await self._arun_inference(messages, **config), prefix
         )
@@ -8,6 +8,8 @@ import os
 
 class Provider(BaseProvider("summarizer", "transformer")):
 
+    token_batch_size = 1000
+
     @classmethod
     def initialize(cls, instance, init):
         if not getattr(cls, "_tokenizer", None):
@@ -62,14 +64,26 @@ class Provider(BaseProvider("summarizer", "transformer")):
     def tokenizer(self):
         return self._tokenizer[self.identifier]
 
-    def get_token_count(self, text):
-        token_count = 0
-        if isinstance(text, (list, tuple)):
-            for section in text:
-                token_count += len(self.tokenizer(section)["input_ids"])
-        elif text and text.strip():
-            token_count = len(self.tokenizer(text)["input_ids"])
-        return token_count
+    def get_tokenizer_name(self):
+        return self._get_token_model_name()
+
+    def _get_token_count(self, text):
+        return len(self.tokenizer(text)["input_ids"])
+
+    def _get_token_counts(self, texts):
+        token_counts = []
+        for index in range(0, len(texts), self.token_batch_size):
+            token_counts.extend(
+                [
+                    len(input_ids)
+                    for input_ids in self.tokenizer(
+                        texts[index : index + self.token_batch_size],
+                        return_attention_mask=False,
+                        return_token_type_ids=False,
+                    )["input_ids"]
+                ]
+            )
+        return token_counts
 
     def get_chunk_length(self):
         return self.tokenizer.model_max_length
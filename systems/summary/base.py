@@ -1,9 +1,15 @@
+from asgiref.sync import sync_to_async
 from django.conf import settings
 
 from systems.models.index import Model
+from systems.summary.chunker import TextChunker, get_chunk_stats
+from systems.summary.reduce import TreeReducer
 from utility.data import Collection, ensure_list
 from utility.topics import TopicModel
 
+import asyncio
+import bisect
+import itertools
 import time
 import re
 import math
@@ -12,6 +18,8 @@ import statistics
 
 class BaseModelSummarizer(object):
 
+    no_info_sentinel = "No information available"
+
     def __init__(
         self,
         command,
@@ -33,7 +41,7 @@ class BaseModelSummarizer(object):
             init=False, provider=self.section_provider
         )
 
-        self.topics = TopicModel()
+        self.topics = TopicModel(self.command)
 
         self.text_facade = Model(text_facade).facade if text_facade else None
         self.instance_order = "created"
@@ -52,34 +60,14 @@ class BaseModelSummarizer(object):
         self.embedding_id_field = self.instance.facade.pk
 
     def _get_text_chunks(self, text, prompt, persona, output_format, max_chunks):
-        max_token_count = self.summarizer.get_chunk_length()
-        prompt_token_count = self.summarizer.get_prompt_token_count(
-            prompt, persona, output_format
+        chunker = TextChunker(
+            self.summarizer,
+            self.summarizer.get_chunk_length(),
+            self.summarizer.get_prompt_token_count(prompt, persona, output_format),
+            command=self.command,
+            max_chunks=max_chunks,
         )
-        token_count = prompt_token_count
-
-        chunks = [""]
-        chunk_index = 0
-
-        if text.strip():
-            for section_index, section in enumerate(
-                self.command.parse_text_sections(text)
-            ):
-                tokens = self.summarizer.get_token_count(section)
-                if (token_count + tokens) > max_token_count:
-                    chunk_index += 1
-                    if not max_chunks or chunk_index < max_chunks:
-                        chunks.append(section)
-                        token_count = prompt_token_count + tokens
-                    else:
-                        break
-                else:
-                    token_count += tokens
-                    chunks[chunk_index] = "{}\n\n{}".format(
-                        chunks[chunk_index], section
-                    )
-
-        return chunks
+        return chunker.split(text) or [""]
 
     def _get_chunks(
         self,
@@ -132,6 +120,7 @@ class BaseModelSummarizer(object):
             document_indexes = {}
 
             search_topics = self.topics.parse(user_prompt if user_prompt else prompt)
+            search_index = self.topics.get_topic_index(search_topics)
             document_topic_scores = {}
 
             document_results = self.document_facade.filter(
@@ -145,10 +134,27 @@ class BaseModelSummarizer(object):
                 self.command.data("Document Results", document_results)
                 self.command.data("Search Topics", search_topics)
 
+            # Stored description topics keep query time scoring free of parsing
+            document_descriptions = {}
+            described_documents = [
+                document for document in document_results if document.description
+            ]
+            for document, description_topics in zip(
+                described_documents,
+                self.topics.parse_many(
+                    [document.description for document in described_documents],
+                    state_keys=[
+                        "description.{}.{}".format(
+                            document._meta.label_lower, document.id
+                        )
+                        for document in described_documents
+                    ],
+                ),
+            ):
+                document_descriptions[document.id] = description_topics
+
             for document in document_results:
-                topic_score = self.topics.get_topic_score(
-                    search_topics, document.topics
-                )
+                topic_score = search_index.get_topic_score(document.topics)
 
                 if self.command.debug and self.command.verbosity > 2:
                     self.command.info(
@@ -158,10 +164,8 @@ class BaseModelSummarizer(object):
                     self.command.data("Document Topic Score", topic_score)
 
                 if document.description:
-                    description_topics = self.topics.parse(document.description)
-                    topic_score += self.topics.get_topic_score(
-                        search_topics, description_topics
-                    )
+                    description_topics = document_descriptions[document.id]
+                    topic_score += search_index.get_topic_score(description_topics)
 
                     if self.command.debug and self.command.verbosity > 2:
                         self.command.data("Description Topics", description_topics)
@@ -172,6 +176,7 @@ class BaseModelSummarizer(object):
 
             if self.command.debug and self.command.verbosity > 2:
                 self.command.data("Document Topic Scores", document_topic_scores)
+                self.command.data("Topic Cache", self.topics.get_cache_stats())
 
             if document_topic_scores:
                 search = self.command.generate_text_embeddings(
@@ -190,8 +195,8 @@ class BaseModelSummarizer(object):
                     for ranking_index, sentence_info in enumerate(ranking):
                         sentence = sentence_info.payload["sentence"].strip()
                         document_id = sentence_info.payload[self.embedding_id_field]
-                        topic_score = self.topics.get_topic_score(
-                            search_topics, sentence_info.payload["topics"]
+                        topic_score = search_index.get_topic_score(
+                            sentence_info.payload["topics"]
                         )
 
                         document_indexes["{}:{}".format(document_id, sentence)] = int(
@@ -288,9 +293,10 @@ class BaseModelSummarizer(object):
     ):
         max_token_count = self.section_summarizer.get_chunk_length()
         max_period_tokens = max_section_tokens / 2
-        sentence_map = {}
         sections = []
 
+        document_key = "{}.{}".format(document._meta.label_lower, document.id)
+
         if document.text and not document.sentences:
             document.sentences = (
                 self.command.parse_sentences(document.text, validate=False)
@@ -298,46 +304,38 @@ class BaseModelSummarizer(object):
                 else []
             )
             document.save()
+            self.command.clear_sentence_token_counts(document_key)
+
+        document_sentences = [
+            str(sentence).strip() if sentence else ""
+            for sentence in (document.sentences if sentences else [])
+        ]
+        # Counts are stored with the document per tokenizer so stored documents
+        # are not tokenized again at query time
+        document_tokens = self.command.get_sentence_token_counts(
+            self.section_summarizer, document_sentences, key=document_key
+        )
+        # Window bounds are found by binary search over cumulative token counts
+        # so each sentence is tokenized once however much windows overlap
+        token_offsets = [0, *itertools.accumulate(int(x) for x in document_tokens)]
+        windows = []
 
         for sentence in set(sentences):
-            sentence_tokens = self.section_summarizer.get_token_count(sentence)
-            before_context = []
-            before_tokens = 0
-            after_context = []
-            after_tokens = 0
-
-            try:
-                sentence_index = indexes["{}:{}".format(document.id, sentence)]
-                sentence_map[sentence_index] = document.sentences[sentence_index]
-
-            except ValueError as e:
+            sentence_index = indexes.get("{}:{}".format(document.id, sentence), None)
+            if sentence_index is None or sentence_index >= len(document_sentences):
                 continue
 
-            # Find relevant before
-            for before_index in range((sentence_index - 1), -1, -1):
-                previous_sentence = document.sentences[before_index]
-                if previous_sentence:
-                    previous_sentence = str(previous_sentence)
-                    previous_tokens = self.section_summarizer.get_token_count(
-                        previous_sentence
-                    )
-                    if (before_tokens + previous_tokens) > max_period_tokens:
-                        break
-                    before_context.append(previous_sentence)
-                    before_tokens += previous_tokens
-                    sentence_map[before_index] = previous_sentence
-
-            # Find relevant after
-            for after_index in range((sentence_index + 1), len(document.sentences)):
-                next_sentence = document.sentences[after_index]
-                if next_sentence:
-                    next_sentence = str(next_sentence)
-                    next_tokens = self.section_summarizer.get_token_count(next_sentence)
-                    if (after_tokens + next_tokens) > max_period_tokens:
-                        break
-                    after_context.append(next_sentence)
-                    after_tokens += next_tokens
-                    sentence_map[after_index] = next_sentence
+            start_index = bisect.bisect_left(
+                token_offsets, token_offsets[sentence_index] - max_period_tokens
+            )
+            end_index = (
+                bisect.bisect_right(
+                    token_offsets,
+                    token_offsets[sentence_index + 1] + max_period_tokens,
+                )
+                - 1
+            )
+            windows.append((start_index, sentence_index, end_index))
 
             # Find similarity around context
             if self.command.debug and self.command.verbosity > 2:
@@ -348,17 +346,34 @@ class BaseModelSummarizer(object):
                 self.command.info("-------------------------------")
                 self.command.notice("{} ( {} )".format(sentence, sentence_index))
                 self.command.notice(
-                    "Tokens: {} / {}".format(before_tokens, after_tokens)
+                    "Tokens: {} / {}".format(
+                        token_offsets[sentence_index] - token_offsets[start_index],
+                        token_offsets[end_index] - token_offsets[sentence_index + 1],
+                    )
                 )
 
         previous_index = None
         section = []
         token_count = prompt_token_count
 
-        for sentence_index in sorted(sentence_map.keys()):
-            sentence = sentence_map[sentence_index].strip()
-            sentence_tokens = self.section_summarizer.get_token_count(sentence)
+        section_indexes = []
+        sentence_indexes = set([window[1] for window in windows])
+        for start_index, sentence_index, end_index in sorted(windows):
+            # Overlapping windows are merged so shared context is emitted once
+            if section_indexes:
+                start_index = max(start_index, section_indexes[-1] + 1)
+            section_indexes.extend(
+                index
+                for index in range(start_index, end_index)
+                if document_sentences[index] or index in sentence_indexes
+            )
+
+        section_sentences = [document_sentences[index] for index in section_indexes]
+        section_tokens = [document_tokens[index] for index in section_indexes]
 
+        for sentence_index, sentence, sentence_tokens in zip(
+            section_indexes, section_sentences, section_tokens
+        ):
             if (
                 previous_index is None
                 or ((sentence_index - previous_index) > 1)
@@ -404,50 +419,82 @@ class BaseModelSummarizer(object):
 
         return sections
 
-    def generate(
-        self,
-        prompt,
-        search_prompt=None,
-        user_prompt=None,
-        output_format="",
-        output_endings=None,
-        max_chunks=10,
-        include_files=True,
-        sentence_limit=50,
-        **config
-    ):
-        max_token_count = self.summarizer.get_chunk_length()
-        persona = config.get("persona", "")
-
-        if output_endings is None:
-            output_endings = [".", "?", "!"]
-
-        def generate_summary(info):
-            chunk = info["chunk"]
-            chunk_text = chunk["text"] if isinstance(chunk, dict) else chunk
-            _sub_prompt = """
+    def _get_map_prompt(self, prompt):
+        return """
 Extract only the relevant information from the provided text for the following request: {}
 
 If there is no relevant information in the provided text
-return only the phrase: No information available.
+return only the phrase: {}.
 """.format(
-                prompt
+            prompt, self.no_info_sentinel
+        )
+
+    def _get_summary_chunks(
+        self,
+        text,
+        prompt,
+        max_chunks,
+        search_prompt,
+        user_prompt,
+        include_files,
+        sentence_limit,
+        persona,
+        output_format,
+    ):
+        if text is not None:
+            chunks = self._get_text_chunks(
+                text, prompt, persona, output_format, max_chunks
             )
+            documents = {}
+
             if self.command.debug and self.command.verbosity > 2:
-                self.command.data(
-                    "Prompt tokens",
-                    self.section_summarizer.get_token_count(_sub_prompt),
-                )
-                self.command.data(
-                    "Chunk tokens", self.section_summarizer.get_token_count(chunk_text)
-                )
+                self.command.info("Text chunks:")
+                for chunk in chunks:
+                    self.command.data(
+                        "Chunk Tokens", self.summarizer.get_token_count(chunk)
+                    )
+        else:
+            chunks, documents = self._get_chunks(
+                prompt,
+                max_chunks,
+                search_prompt=search_prompt,
+                user_prompt=user_prompt,
+                include_files=include_files,
+                sentence_limit=sentence_limit,
+                persona=persona,
+                output_format=output_format,
+            )
 
-            _summary = self.command.generate_summary(
-                chunk_text, prompt=_sub_prompt, provider=self.section_provider, **config
+        if self.command.debug and self.command.verbosity > 2:
+            self.command.data("Summary Chunks", chunks)
+            self.command.info("Summary Documents")
+            for document_id, info in documents.items():
+                self.command.data(document_id, info["score"])
+
+        return [
+            {"index": index, "chunk": chunk} for index, chunk in enumerate(chunks)
+        ], documents
+
+    def _get_map_text(self, info, prompt):
+        chunk = info["chunk"]
+        chunk_text = chunk["text"] if isinstance(chunk, dict) else chunk
+
+        if self.command.debug and self.command.verbosity > 2:
+            self.command.data(
+                "Prompt tokens",
+                self.section_summarizer.get_token_count(self._get_map_prompt(prompt)),
             )
-            if self.command.debug and self.command.verbosity > 2:
-                self.command.notice(
-                    """
+            self.command.data(
+                "Chunk tokens", self.section_summarizer.get_token_count(chunk_text)
+            )
+        return chunk_text
+
+    def _get_map_result(self, info, summary):
+        chunk = info["chunk"]
+
+        if self.command.debug and self.command.verbosity > 2:
+            self.command.notice(
+                """
 ================================
 {}
 ................................
@@ -455,130 +502,82 @@ Request Tokens: {}
 Response Tokens: {}
 Summary Cost: ${}
 """.format(
-                        _summary.text,
-                        _summary.request_tokens,
-                        _summary.response_tokens,
-                        _summary.cost,
-                    )
+                    summary.text,
+                    summary.request_tokens,
+                    summary.response_tokens,
+                    summary.cost,
                 )
+            )
 
-            summary_text = _summary.text.strip()
-            if re.search(r"^No information available", summary_text):
-                summary_text = ""
-
-            return {
-                "index": info["index"],
-                "type": chunk["type"] if isinstance(chunk, dict) else "text",
-                "id": chunk["id"] if isinstance(chunk, dict) else None,
-                "text": summary_text,
-                "request_tokens": _summary.request_tokens,
-                "response_tokens": _summary.response_tokens,
-                "cost": _summary.cost,
-            }
-
-        def summarize(text=None):
-            _summary_text = ""
-
-            if text is not None:
-                _chunks = self._get_text_chunks(
-                    text, prompt, persona, output_format, max_chunks
-                )
-                _documents = {}
-
-                if self.command.debug and self.command.verbosity > 2:
-                    self.command.info("Text chunks:")
-                    for chunk in _chunks:
-                        self.command.data(
-                            "Chunk Tokens", self.summarizer.get_token_count(chunk)
-                        )
+        summary_text = summary.text.strip()
+        if summary_text.startswith(self.no_info_sentinel):
+            summary_text = ""
+
+        return {
+            "index": info["index"],
+            "type": chunk["type"] if isinstance(chunk, dict) else "text",
+            "id": chunk["id"] if isinstance(chunk, dict) else None,
+            "text": summary_text,
+            "request_tokens": summary.request_tokens,
+            "response_tokens": summary.response_tokens,
+            "cost": summary.cost,
+            "cached": summary.cached,
+        }
+
+    def _merge_map_results(self, results, documents):
+        request_tokens = 0
+        response_tokens = 0
+        processing_cost = 0
+        chunk_text = {}
+
+        for result in results:
+            request_tokens += result["request_tokens"]
+            response_tokens += result["response_tokens"]
+            processing_cost += result["cost"]
+
+            if result["text"]:
+                chunk_text[result["index"]] = result["text"]
             else:
-                _chunks, _documents = self._get_chunks(
-                    prompt,
-                    max_chunks,
-                    search_prompt=search_prompt,
-                    user_prompt=user_prompt,
-                    include_files=include_files,
-                    sentence_limit=sentence_limit,
-                    persona=persona,
-                    output_format=output_format,
-                )
-
-            if self.command.debug and self.command.verbosity > 2:
-                self.command.data("Summary Chunks", _chunks)
-                self.command.info("Summary Documents")
-                for document_id, info in _documents.items():
-                    self.command.data(document_id, info["score"])
-
-            _chunks = [
-                {"index": _index, "chunk": _chunk}
-                for _index, _chunk in enumerate(_chunks)
-            ]
-            _request_tokens = 0
-            _response_tokens = 0
-            _processing_cost = 0
-
-            if len(_chunks):
-                if len(_chunks) > 1:
-                    _results = self.command.run_list(_chunks, generate_summary)
-                    _chunk_text = {}
-                    _chunk_tokens = 0
-
-                    for _chunk in _results.data:
-                        _request_tokens += _chunk.result["request_tokens"]
-                        _response_tokens += _chunk.result["response_tokens"]
-                        _processing_cost += _chunk.result["cost"]
-
-                        if _chunk.result["text"]:
-                            _text_tokens = self.summarizer.get_token_count(
-                                _chunk.result["text"]
-                            )
-                            if (_chunk_tokens + _text_tokens) <= max_token_count:
-                                _chunk_text[_chunk.result["index"]] = _chunk.result[
-                                    "text"
-                                ]
-                                _chunk_tokens += _text_tokens
-                        else:
-                            if self.command.debug and self.command.verbosity > 2:
-                                self.command.data("Removing Document", _chunk.result)
-
-                            _documents.pop(_chunk.result["id"], None)
-
-                    _summary_input_text = "\n\n".join(
-                        [_chunk_text[_index] for _index in sorted(_chunk_text.keys())]
-                    )
+                if self.command.debug and self.command.verbosity > 2:
+                    self.command.data("Removing Document", result)
+
+                documents.pop(result["id"], None)
+
+        summary_texts = [chunk_text[index] for index in sorted(chunk_text.keys())]
+        if self.command.debug and self.command.verbosity > 2:
+            self.command.data("Summary Input Text", summary_texts)
+
+        return summary_texts, request_tokens, response_tokens, processing_cost
+
+    def _get_reducer(self, prompt, persona, output_format, fan_in):
+        # Intermediate levels use the section provider with the extraction prompt
+        # and the final level the summary provider, so groups must fit both
+        return TreeReducer(
+            self.command,
+            self.summarizer,
+            min(
+                self.summarizer.get_chunk_length(),
+                self.section_summarizer.get_chunk_length(),
+            ),
+            max(
+                self.summarizer.get_prompt_token_count(prompt, persona, output_format),
+                self.section_summarizer.get_prompt_token_count(
+                    self._get_map_prompt(prompt), persona
+                ),
+            ),
+            fan_in=fan_in,
+        )
 
-                    if self.command.debug and self.command.verbosity > 2:
-                        self.command.data("Summary Input Text", _summary_input_text)
-
-                    (
-                        _summary_text,
-                        _final_request_tokens,
-                        _final_response_tokens,
-                        _final_cost,
-                        _chunk_documents,
-                    ) = summarize(_summary_input_text)
-
-                    _request_tokens += _final_request_tokens
-                    _response_tokens += _final_response_tokens
-                    _processing_cost += _final_cost
-                else:
-                    _chunk = _chunks[0]["chunk"]
-                    _summary = self.command.generate_summary(
-                        _chunk["text"] if isinstance(_chunk, dict) else _chunk,
-                        prompt=prompt,
-                        output_format=output_format,
-                        endings=output_endings,
-                        provider=self.provider,
-                        **config
-                    )
-                    _summary_text = _summary.text
-                    _request_tokens += _summary.request_tokens
-                    _response_tokens += _summary.response_tokens
-                    _processing_cost += _summary.cost
+    def _get_reduce_result(self, summary):
+        summary_text = summary.text.strip()
+        if summary_text.startswith(self.no_info_sentinel):
+            summary.text = ""
+        return summary
 
-                    if self.command.debug and self.command.verbosity > 2:
-                        self.command.notice(
-                            """
+    def _display_summary(self, text, request_tokens, response_tokens, cost):
+        if self.command.debug and self.command.verbosity > 2:
+            self.command.notice(
+                """
 **================================**
 {}
 **................................**
@@ -586,30 +585,231 @@ Request Tokens: {}
 Response Tokens: {}
 Summary Cost: ${}
 """.format(
-                                _summary_text,
-                                _request_tokens,
-                                _response_tokens,
-                                _processing_cost,
-                            )
-                        )
-
-            return (
-                _summary_text,
-                _response_tokens,
-                _response_tokens,
-                _processing_cost,
-                _documents,
+                    text,
+                    request_tokens,
+                    response_tokens,
+                    cost,
+                )
             )
 
-        start_time = time.time()
-        summary_text, request_tokens, response_tokens, cost, documents = summarize()
+    def _get_summary(
+        self,
+        start_time,
+        reduction,
+        documents,
+        chunk_stats,
+        request_tokens,
+        response_tokens,
+        cost,
+    ):
+        self._display_summary(
+            reduction.text,
+            reduction.request_tokens,
+            reduction.response_tokens,
+            reduction.cost,
+        )
+        request_tokens += reduction.request_tokens
+        response_tokens += reduction.response_tokens
 
         return Collection(
-            text=summary_text,
+            text=reduction.text,
             documents=documents,
             request_tokens=request_tokens,
             response_tokens=response_tokens,
             token_count=(request_tokens + response_tokens),
             processing_time=(time.time() - start_time),
-            processing_cost=cost,
+            processing_cost=(cost + reduction.cost),
+            reduce_depth=reduction.depth,
+            reduce_levels=reduction.levels,
+            **chunk_stats,
+        )
+
+    def generate(
+        self,
+        prompt,
+        search_prompt=None,
+        user_prompt=None,
+        output_format="",
+        output_endings=None,
+        max_chunks=10,
+        include_files=True,
+        sentence_limit=50,
+        text=None,
+        fan_in=None,
+        **config
+    ):
+        persona = config.get("persona", "")
+
+        if output_endings is None:
+            output_endings = [".", "?", "!"]
+
+        def generate_summary(info):
+            _summary = self.command.generate_summary(
+                self._get_map_text(info, prompt),
+                prompt=self._get_map_prompt(prompt),
+                provider=self.section_provider,
+                stream=True,
+                stop_sentinel=self.no_info_sentinel,
+                **config
+            )
+            return self._get_map_result(info, _summary)
+
+        def reduce_summary(text):
+            return self._get_reduce_result(
+                self.command.generate_summary(
+                    text,
+                    prompt=self._get_map_prompt(prompt),
+                    provider=self.section_provider,
+                    stream=True,
+                    stop_sentinel=self.no_info_sentinel,
+                    **config
+                )
+            )
+
+        def final_summary(text):
+            return self.command.generate_summary(
+                text,
+                prompt=prompt,
+                output_format=output_format,
+                endings=output_endings,
+                provider=self.provider,
+                **config
+            )
+
+        start_time = time.time()
+        chunks, documents = self._get_summary_chunks(
+            text,
+            prompt,
+            max_chunks,
+            search_prompt,
+            user_prompt,
+            include_files,
+            sentence_limit,
+            persona,
+            output_format,
+        )
+        request_tokens = 0
+        response_tokens = 0
+        cost = 0
+
+        results = []
+
+        if len(chunks) > 1:
+            results = [
+                chunk.result
+                for chunk in self.command.run_list(chunks, generate_summary).data
+            ]
+            texts, request_tokens, response_tokens, cost = self._merge_map_results(
+                results, documents
+            )
+        else:
+            texts = [self._get_map_text(chunk, prompt) for chunk in chunks]
+
+        return self._get_summary(
+            start_time,
+            self._get_reducer(prompt, persona, output_format, fan_in).reduce(
+                texts, reduce_summary, final_summary
+            ),
+            documents,
+            get_chunk_stats(results),
+            request_tokens,
+            response_tokens,
+            cost,
+        )
+
+    async def agenerate(
+        self,
+        prompt,
+        search_prompt=None,
+        user_prompt=None,
+        output_format="",
+        output_endings=None,
+        max_chunks=10,
+        include_files=True,
+        sentence_limit=50,
+        text=None,
+        fan_in=None,
+        concurrency=None,
+        **config
+    ):
+        persona = config.get("persona", "")
+        semaphore = asyncio.Semaphore(
+            concurrency if concurrency else settings.SUMMARIZER_MAP_CONCURRENCY
+        )
+
+        if output_endings is None:
+            output_endings = [".", "?", "!"]
+
+        async def generate_summary(info):
+            async with semaphore:
+                _summary = await self.command.agenerate_summary(
+                    self._get_map_text(info, prompt),
+                    prompt=self._get_map_prompt(prompt),
+                    provider=self.section_provider,
+                    stream=True,
+                    stop_sentinel=self.no_info_sentinel,
+                    **config
+                )
+            return self._get_map_result(info, _summary)
+
+        async def reduce_summary(text):
+            return self._get_reduce_result(
+                await self.command.agenerate_summary(
+                    text,
+                    prompt=self._get_map_prompt(prompt),
+                    provider=self.section_provider,
+                    stream=True,
+                    stop_sentinel=self.no_info_sentinel,
+                    **config
+                )
+            )
+
+        async def final_summary(text):
+            return await self.command.agenerate_summary(
+                text,
+                prompt=prompt,
+                output_format=output_format,
+                endings=output_endings,
+                provider=self.provider,
+                **config
+            )
+
+        start_time = time.time()
+        chunks, documents = await sync_to_async(self._get_summary_chunks)(
+            text,
+            prompt,
+            max_chunks,
+            search_prompt,
+            user_prompt,
+            include_files,
+            sentence_limit,
+            persona,
+            output_format,
+        )
+        request_tokens = 0
+        response_tokens = 0
+        cost = 0
+
+        results = []
+
+        if len(chunks) > 1:
+            results = await asyncio.gather(
+                *[generate_summary(chunk) for chunk in chunks]
+            )
+            texts, request_tokens, response_tokens, cost = self._merge_map_results(
+                results, documents
+            )
+        else:
+            texts = [self._get_map_text(chunk, prompt) for chunk in chunks]
+
+        return self._get_summary(
+            start_time,
+            await self._get_reducer(prompt, persona, output_format, fan_in).areduce(
+                texts, reduce_summary, final_summary, concurrency=concurrency
+            ),
+            documents,
+            get_chunk_stats(results),
+            request_tokens,
+            response_tokens,
+            cost,
         )
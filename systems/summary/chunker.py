@@ -0,0 +1,234 @@
+from django.conf import settings
+
+from utility.cache import get_hash_key
+
+import re
+
+
+section_separator = re.compile(r"\n\n+")
+leading_space = re.compile(r"\s*")
+
+
+def split_paragraphs(text):
+    return [
+        paragraph.strip()
+        for paragraph in section_separator.split(text.strip())
+        if paragraph.strip()
+    ]
+
+
+def get_section_offsets(text, max_length=10000):
+    # Paragraphs are packed until a section reaches max_length and only the
+    # (start, end) offsets are kept so sections are sliced from the source once
+    offsets = []
+    start = None
+    end = None
+    length = 0
+
+    def add_paragraph(paragraph_start, paragraph_end):
+        nonlocal start, end, length
+
+        content_start = leading_space.match(text, paragraph_start, paragraph_end).end()
+        while paragraph_end > content_start and text[paragraph_end - 1].isspace():
+            paragraph_end -= 1
+
+        if content_start < paragraph_end:
+            # Lengths count a single newline between paragraphs so the packing
+            # does not depend on how many blank lines separate them
+            if start is None:
+                start = content_start
+                length = paragraph_end - content_start
+            else:
+                length += paragraph_end - paragraph_start + 1
+            end = paragraph_end
+
+            if length >= max_length:
+                offsets.append((start, end))
+                start = None
+
+    position = 0
+    for separator in section_separator.finditer(text):
+        add_paragraph(position, separator.start())
+        position = separator.end()
+    add_paragraph(position, len(text))
+
+    if start is not None:
+        offsets.append((start, end))
+    return offsets
+
+
+def is_anchor(section, divisor):
+    return int.from_bytes(get_hash_key(section)[:4], "little") % divisor == 0
+
+
+class TextChunker(object):
+
+    boundaries = ("greedy", "content")
+
+    def __init__(
+        self,
+        summarizer,
+        max_token_count,
+        prompt_token_count=0,
+        command=None,
+        max_chunks=None,
+        max_sections=None,
+        overlap=None,
+        boundary=None,
+        batch_size=512,
+        min_ratio=0.75,
+        divisor=4,
+        separator="\n\n",
+    ):
+        if boundary is None:
+            boundary = settings.SUMMARIZER_CHUNK_BOUNDARY
+        if boundary not in self.boundaries:
+            raise ValueError(
+                "Chunk boundary {} not supported, must be one of: {}".format(
+                    boundary, ", ".join(self.boundaries)
+                )
+            )
+        self.summarizer = summarizer
+        self.command = command
+        self.max_token_count = max_token_count
+        self.prompt_token_count = prompt_token_count
+        self.max_chunks = max_chunks
+        self.max_sections = max_sections
+        self.overlap = (
+            overlap if overlap is not None else settings.SUMMARIZER_CHUNK_OVERLAP
+        )
+        self.boundary = boundary
+        self.batch_size = batch_size
+        self.divisor = divisor
+        self.separator = separator
+
+        # Content boundaries only close a chunk once it holds a minimum share of
+        # the budget so anchors do not fragment the text into tiny chunks
+        self.min_token_count = prompt_token_count + (
+            (max_token_count - prompt_token_count) * min_ratio
+        )
+        self.reset()
+
+    def reset(self):
+        self.buffer = []
+        self.buffer_tokens = []
+        self.token_count = self.prompt_token_count
+        self.carried = 0
+        self.chunk_count = 0
+
+    def _emit(self):
+        chunk = self.separator.join(self.buffer)
+        self.chunk_count += 1
+
+        carry = []
+        carry_tokens = []
+        if self.overlap:
+            overlap_tokens = 0
+            for section, tokens in zip(
+                reversed(self.buffer), reversed(self.buffer_tokens)
+            ):
+                if (overlap_tokens + tokens) > self.overlap:
+                    break
+                carry.insert(0, section)
+                carry_tokens.insert(0, tokens)
+                overlap_tokens += tokens
+
+        self.buffer = carry
+        self.buffer_tokens = carry_tokens
+        self.token_count = self.prompt_token_count + sum(carry_tokens)
+        self.carried = len(carry)
+        return chunk
+
+    def _is_full(self, tokens):
+        return (self.token_count + tokens) > self.max_token_count or (
+            self.max_sections and len(self.buffer) >= self.max_sections
+        )
+
+    def add(self, section, tokens):
+        chunks = []
+
+        if self.buffer and self._is_full(tokens):
+            if len(self.buffer) > self.carried:
+                chunks.append(self._emit())
+            if self.buffer and self._is_full(tokens):
+                # Overlap never forces a section out of its own chunk
+                self.buffer = []
+                self.buffer_tokens = []
+                self.token_count = self.prompt_token_count
+                self.carried = 0
+
+        self.buffer.append(section)
+        self.buffer_tokens.append(tokens)
+        self.token_count += tokens
+
+        if (
+            self.boundary == "content"
+            and self.token_count >= self.min_token_count
+            and is_anchor(section, self.divisor)
+        ):
+            chunks.append(self._emit())
+        return chunks
+
+    def flush(self):
+        chunks = []
+        if len(self.buffer) > self.carried:
+            chunks.append(self._emit())
+
+        self.buffer = []
+        self.buffer_tokens = []
+        self.token_count = self.prompt_token_count
+        self.carried = 0
+        return chunks
+
+    def get_sections(self, text):
+        if isinstance(text, (list, tuple)):
+            text = "\n\n".join(text)
+        if not text or not text.strip():
+            return []
+
+        if self.boundary == "content" or not self.command:
+            return split_paragraphs(text)
+        return self.command.parse_text_sections(text)
+
+    def _get_token_counts(self, sections):
+        if not self.batch_size:
+            for section in sections:
+                yield section, self.summarizer.get_token_count(section)
+        else:
+            for start in range(0, len(sections), self.batch_size):
+                batch = sections[start : start + self.batch_size]
+                for section, tokens in zip(
+                    batch, self.summarizer.get_token_counts(batch)
+                ):
+                    yield section, int(tokens)
+
+    def chunk(self, sections, token_counts=None):
+        chunks = []
+        self.reset()
+
+        section_tokens = (
+            zip(sections, token_counts)
+            if token_counts is not None
+            else self._get_token_counts(sections)
+        )
+        for section, tokens in section_tokens:
+            for chunk in self.add(section, tokens):
+                chunks.append(chunk)
+                if self.max_chunks and len(chunks) >= self.max_chunks:
+                    return chunks
+
+        chunks.extend(self.flush())
+        return chunks[: self.max_chunks] if self.max_chunks else chunks
+
+    def split(self, text):
+        return self.chunk(self.get_sections(text))
+
+
+def get_chunk_stats(results, dropped=0):
+    cached = len([result for result in results if result.get("cached", False)])
+    return {
+        "map_chunks": len(results),
+        "cached_chunks": cached,
+        "fresh_chunks": len(results) - cached,
+        "dropped_chunks": dropped,
+    }
@@ -0,0 +1,161 @@
+from django.conf import settings
+
+from systems.summary.chunker import TextChunker
+from utility.data import Collection
+
+import asyncio
+import time
+
+
+class SummaryReduceError(Exception):
+    pass
+
+
+class TreeReducer(object):
+
+    def __init__(
+        self,
+        command,
+        summarizer,
+        max_token_count,
+        prompt_token_count,
+        fan_in=None,
+        max_depth=None,
+    ):
+        self.command = command
+        self.summarizer = summarizer
+        self.token_budget = max(max_token_count - prompt_token_count, 1)
+        self.fan_in = max(fan_in if fan_in else settings.SUMMARIZER_REDUCE_FAN_IN, 2)
+        self.max_depth = (
+            max_depth if max_depth else settings.SUMMARIZER_REDUCE_MAX_DEPTH
+        )
+
+        self.request_tokens = 0
+        self.response_tokens = 0
+        self.cost = 0
+        self.levels = []
+
+    def get_groups(self, texts):
+        chunker = TextChunker(
+            self.summarizer,
+            self.token_budget,
+            command=self.command,
+            max_sections=self.fan_in,
+            overlap=0,
+            boundary="greedy",
+        )
+        sections = []
+
+        for text, tokens in zip(texts, self.summarizer.get_token_counts(texts)):
+            if tokens > self.token_budget:
+                # Oversized inputs are split on section boundaries instead of
+                # being truncated by the provider context window
+                sections.extend(chunker.split(text))
+            else:
+                sections.append(text)
+
+        return chunker.chunk(sections)
+
+    def _add_summary(self, summary):
+        self.request_tokens += summary.request_tokens
+        self.response_tokens += summary.response_tokens
+        self.cost += summary.cost
+
+    def _add_level(self, start_time, inputs, groups):
+        level = {
+            "level": len(self.levels) + 1,
+            "inputs": inputs,
+            "groups": groups,
+            "time": round(time.time() - start_time, 3),
+        }
+        self.levels.append(level)
+
+        if self.command.debug and self.command.verbosity > 2:
+            self.command.data("Reduce Level", level)
+
+    def _get_level_texts(self, summaries):
+        texts = []
+        for summary in summaries:
+            self._add_summary(summary)
+            if summary.text.strip():
+                texts.append(summary.text.strip())
+        return texts
+
+    def _get_final_groups(self, texts):
+        groups = self.get_groups(texts)
+
+        if len(groups) > 1 and len(self.levels) >= self.max_depth:
+            # Joining the remaining groups would overflow the final request and
+            # be silently truncated by the provider context window
+            raise SummaryReduceError(
+                "Summary reduction left {} groups after {} levels".format(
+                    len(groups), self.max_depth
+                )
+            )
+        return groups
+
+    def _get_result(self, summary):
+        return Collection(
+            text=summary.text,
+            request_tokens=self.request_tokens,
+            response_tokens=self.response_tokens,
+            cost=self.cost,
+            depth=len(self.levels),
+            levels=self.levels,
+        )
+
+    def _get_empty_result(self):
+        # A final request without context would be answered from the model's
+        # own knowledge so nothing is sent and callers decide what to report
+        return self._get_result(Collection(text=""))
+
+    def reduce(self, texts, reduce_summary, final_summary):
+        texts = [text for text in texts if text and text.strip()]
+        if not texts:
+            return self._get_empty_result()
+
+        while True:
+            start_time = time.time()
+            groups = self._get_final_groups(texts)
+
+            if len(groups) <= 1:
+                summary = final_summary(groups[0] if groups else "")
+                self._add_summary(summary)
+                self._add_level(start_time, len(texts), 1)
+                return self._get_result(summary)
+
+            results = self.command.run_list(
+                [{"index": index, "text": text} for index, text in enumerate(groups)],
+                lambda info: (info["index"], reduce_summary(info["text"])),
+            )
+            summaries = sorted(
+                [result.result for result in results.data], key=lambda x: x[0]
+            )
+            self._add_level(start_time, len(texts), len(groups))
+            texts = self._get_level_texts([summary for index, summary in summaries])
+
+    async def areduce(self, texts, reduce_summary, final_summary, concurrency=None):
+        semaphore = asyncio.Semaphore(
+            concurrency if concurrency else settings.SUMMARIZER_MAP_CONCURRENCY
+        )
+        texts = [text for text in texts if text and text.strip()]
+        if not texts:
+            return self._get_empty_result()
+
+        async def run_reduce(text):
+            async with semaphore:
+                return await reduce_summary(text)
+
+        while True:
+            start_time = time.time()
+            groups = self._get_final_groups(texts)
+
+            if len(groups) <= 1:
+                summary = await final_summary(groups[0] if groups else "")
+                self._add_summary(summary)
+                self._add_level(start_time, len(texts), 1)
+                return self._get_result(summary)
+
+            summaries = await asyncio.gather(*[run_reduce(text) for text in groups])
+            self._add_level(start_time, len(texts), len(groups))
+            texts = self._get_level_texts(summaries)
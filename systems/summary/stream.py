@@ -0,0 +1,267 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from systems.summary.chunker import TextChunker, section_separator
+from systems.summary.reduce import TreeReducer
+from utility.data import Collection
+from utility.transport import run_async
+
+import asyncio
+import time
+
+
+class StreamSummarizer(object):
+
+    def __init__(
+        self,
+        command,
+        blocks,
+        provider=None,
+        no_info_message=None,
+        max_section_length=10000,
+    ):
+        self.command = command
+        self.blocks = blocks
+        self.max_section_length = max_section_length
+        self.no_info_message = (
+            no_info_message if no_info_message else "No information was found"
+        )
+
+        self.provider = provider
+        self.summarizer = self.command.get_summarizer(
+            init=False, provider=self.provider
+        )
+
+    async def _iter_blocks(self):
+        if hasattr(self.blocks, "__aiter__"):
+            async for block in self.blocks:
+                yield block
+        else:
+            # Blocking sources like file reads or paged queries are pulled off
+            # the event loop one block at a time
+            iterator = iter(self.blocks)
+            end = object()
+            get_block = sync_to_async(lambda: next(iterator, end))
+
+            while True:
+                block = await get_block()
+                if block is end:
+                    break
+                yield block
+
+    async def _iter_sections(self):
+        pending = ""
+
+        async for block in self._iter_blocks():
+            if not block:
+                continue
+
+            sections = section_separator.split(pending + block)
+            pending = sections.pop()
+
+            # Text without paragraph breaks is cut so the carry over stays bounded
+            while len(pending) > self.max_section_length:
+                index = pending.rfind(" ", 0, self.max_section_length)
+                if index <= 0:
+                    index = self.max_section_length
+                sections.append(pending[:index])
+                pending = pending[index:]
+
+            for section in sections:
+                if section.strip():
+                    yield section.strip()
+
+        if pending.strip():
+            yield pending.strip()
+
+    async def _iter_chunks(self, prompt_token_count):
+        chunker = TextChunker(
+            self.summarizer,
+            self.summarizer.get_chunk_length(),
+            prompt_token_count,
+            command=self.command,
+        )
+        async for section in self._iter_sections():
+            for chunk in chunker.add(section, self.summarizer.get_token_count(section)):
+                yield chunk
+
+        for chunk in chunker.flush():
+            yield chunk
+
+    def _get_reducer(self, prompt, persona, output_format, fan_in):
+        return TreeReducer(
+            self.command,
+            self.summarizer,
+            self.summarizer.get_chunk_length(),
+            self.summarizer.get_prompt_token_count(prompt, persona, output_format),
+            fan_in=fan_in,
+        )
+
+    def _get_node(self, text, summaries, reduction=None):
+        request_tokens = sum([summary.request_tokens for summary in summaries])
+        response_tokens = sum([summary.response_tokens for summary in summaries])
+        cost = sum([summary.cost for summary in summaries])
+
+        if reduction:
+            request_tokens += reduction.request_tokens
+            response_tokens += reduction.response_tokens
+            cost += reduction.cost
+
+        return Collection(
+            text=text,
+            request_tokens=request_tokens,
+            response_tokens=response_tokens,
+            cost=cost,
+        )
+
+    def _display_summary(self, text, request_tokens, response_tokens, cost):
+        if self.command.debug and self.command.verbosity > 2:
+            self.command.notice(
+                """
+**================================**
+{}
+**................................**
+Request Tokens: {}
+Response Tokens: {}
+Summary Cost: ${}
+""".format(
+                    text,
+                    request_tokens,
+                    response_tokens,
+                    cost,
+                )
+            )
+
+    def generate(self, prompt, output_format="", output_endings=None, **config):
+        return run_async(
+            self.agenerate(prompt, output_format, output_endings, **config)
+        )
+
+    async def agenerate(
+        self,
+        prompt,
+        output_format="",
+        output_endings=None,
+        fan_in=None,
+        concurrency=None,
+        **config
+    ):
+        persona = config.get("persona", "")
+        concurrency = (
+            concurrency if concurrency else settings.SUMMARIZER_MAP_CONCURRENCY
+        )
+        reducer = self._get_reducer(prompt, persona, output_format, fan_in)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        pending = asyncio.Semaphore(concurrency * 2)
+        levels = []
+        level_info = []
+        chunk_count = 0
+
+        if output_endings is None:
+            output_endings = [".", "?", "!"]
+
+        async def map_summary(text):
+            try:
+                async with semaphore:
+                    return await self.command.agenerate_summary(
+                        text, prompt=prompt, provider=self.provider, **config
+                    )
+            finally:
+                pending.release()
+
+        async def reduce_summary(text):
+            return await self.command.agenerate_summary(
+                text, prompt=prompt, provider=self.provider, **config
+            )
+
+        async def final_summary(text):
+            return await self.command.agenerate_summary(
+                text,
+                prompt=prompt,
+                output_format=output_format,
+                endings=output_endings,
+                provider=self.provider,
+                **config
+            )
+
+        async def reduce_nodes(nodes):
+            summaries = await asyncio.gather(*nodes)
+            texts = [summary.text for summary in summaries if summary.text.strip()]
+            if not texts:
+                return self._get_node("", summaries)
+
+            reduction = await self._get_reducer(
+                prompt, persona, output_format, fan_in
+            ).areduce(texts, reduce_summary, reduce_summary, concurrency=concurrency)
+            return self._get_node(reduction.text, summaries, reduction)
+
+        def add_node(level, node):
+            # Outputs are folded upward as soon as a level fills so only a
+            # bounded number of summaries are held regardless of input size
+            if len(levels) <= level:
+                levels.append([])
+                level_info.append({"level": level + 1, "reductions": 0})
+
+            levels[level].append(node)
+            if len(levels[level]) >= reducer.fan_in:
+                nodes = levels[level]
+                levels[level] = []
+                level_info[level]["reductions"] += 1
+                add_node(level + 1, asyncio.ensure_future(reduce_nodes(nodes)))
+
+        start_time = time.time()
+
+        async for chunk in self._iter_chunks(
+            self.summarizer.get_prompt_token_count(prompt, persona, output_format)
+        ):
+            await pending.acquire()
+            add_node(0, asyncio.ensure_future(map_summary(chunk)))
+            chunk_count += 1
+
+        if not chunk_count:
+            return self._get_summary(
+                start_time, self._get_node(self.no_info_message, []), 0, []
+            )
+
+        summaries = await asyncio.gather(
+            *[node for level in reversed(levels) for node in level]
+        )
+        reduction = await reducer.areduce(
+            [summary.text for summary in summaries],
+            reduce_summary,
+            final_summary,
+            concurrency=concurrency,
+        )
+        summary = self._get_node(
+            reduction.text.strip() or self.no_info_message, summaries, reduction
+        )
+        self._display_summary(
+            summary.text, summary.request_tokens, summary.response_tokens, summary.cost
+        )
+        stream_levels = [info for info in level_info if info["reductions"]]
+        return self._get_summary(
+            start_time,
+            summary,
+            chunk_count,
+            [
+                *stream_levels,
+                *[
+                    {**info, "level": len(stream_levels) + info["level"]}
+                    for info in reduction.levels
+                ],
+            ],
+        )
+
+    def _get_summary(self, start_time, summary, chunk_count, reduce_levels):
+        return Collection(
+            text=summary.text,
+            request_tokens=summary.request_tokens,
+            response_tokens=summary.response_tokens,
+            token_count=(summary.request_tokens + summary.response_tokens),
+            processing_time=(time.time() - start_time),
+            processing_cost=summary.cost,
+            chunks=chunk_count,
+            reduce_depth=len(reduce_levels),
+            reduce_levels=reduce_levels,
+        )
@@ -1,7 +1,10 @@
 from django.conf import settings
 
+from systems.summary.chunker import TextChunker, get_chunk_stats
+from systems.summary.reduce import TreeReducer
 from utility.data import Collection, ensure_list
 
+import asyncio
 import time
 
 
@@ -20,45 +23,18 @@ class TextSummarizer(object):
         )
 
     def _get_chunks(self, text, prompt, output_format="", persona=""):
-        max_token_count = self.summarizer.get_chunk_length()
-        prompt_token_count = self.summarizer.get_prompt_token_count(
-            prompt, persona, output_format
+        chunker = TextChunker(
+            self.summarizer,
+            self.summarizer.get_chunk_length(),
+            self.summarizer.get_prompt_token_count(prompt, persona, output_format),
+            command=self.command,
         )
-        token_count = prompt_token_count
-
-        chunks = [""]
-        chunk_index = 0
-
-        if text:
-            for section_index, section in enumerate(
-                self.command.parse_text_sections(text)
-            ):
-                tokens = self.summarizer.get_token_count(section)
-                if (token_count + tokens) > max_token_count:
-                    chunk_index += 1
-                    chunks.append(section)
-                    token_count = prompt_token_count + tokens
-                else:
-                    token_count += tokens
-                    chunks[chunk_index] = "{}\n\n{}".format(
-                        chunks[chunk_index], section
-                    )
-
-        return chunks
-
-    def generate(self, prompt, output_format="", output_endings=None, **config):
-        persona = config.get("persona", "")
-
-        if output_endings is None:
-            output_endings = [".", "?", "!"]
+        return chunker.split(text) or [""]
 
-        def generate_summary(info):
-            _summary = self.command.generate_summary(
-                info["text"], prompt=prompt, provider=self.provider, **config
-            )
-            if self.command.debug and self.command.verbosity > 2:
-                self.command.notice(
-                    """
+    def _get_chunk_result(self, info, summary):
+        if self.command.debug and self.command.verbosity > 2:
+            self.command.notice(
+                """
 ================================
 {}
 ................................
@@ -66,82 +42,54 @@ Request Tokens: {}
 Response Tokens: {}
 Summary Cost: ${}
 """.format(
-                        _summary.text,
-                        _summary.request_tokens,
-                        _summary.response_tokens,
-                        _summary.cost,
-                    )
+                    summary.text,
+                    summary.request_tokens,
+                    summary.response_tokens,
+                    summary.cost,
                 )
+            )
 
-            return {
-                "index": info["index"],
-                "text": _summary.text.strip(),
-                "request_tokens": _summary.request_tokens,
-                "response_tokens": _summary.response_tokens,
-                "cost": _summary.cost,
-            }
-
-        def summarize(text):
-            _summary_text = ""
-            _chunks = [
-                {"index": _index, "text": _chunk}
-                for _index, _chunk in enumerate(
-                    self._get_chunks(
-                        text,
-                        prompt=prompt,
-                        output_format=output_format,
-                        persona=persona,
-                    )
-                )
-            ]
+        return {
+            "index": info["index"],
+            "text": summary.text.strip(),
+            "request_tokens": summary.request_tokens,
+            "response_tokens": summary.response_tokens,
+            "cost": summary.cost,
+            "cached": summary.cached,
+        }
 
-            _request_tokens = 0
-            _response_tokens = 0
-            _processing_cost = 0
-
-            if len(_chunks):
-                if len(_chunks) > 1:
-                    _results = self.command.run_list(_chunks, generate_summary)
-                    _chunk_text = {}
-                    for _chunk in _results.data:
-                        _chunk_text[_chunk.result["index"]] = _chunk.result["text"]
-                        _request_tokens += _chunk.result["request_tokens"]
-                        _response_tokens += _chunk.result["response_tokens"]
-                        _processing_cost += _chunk.result["cost"]
-
-                    (
-                        _summary_text,
-                        _final_request_tokens,
-                        _final_response_tokens,
-                        _final_cost,
-                    ) = summarize(
-                        "\n\n".join(
-                            [
-                                _chunk_text[_index]
-                                for _index in sorted(_chunk_text.keys())
-                            ]
-                        )
-                    )
-                    _request_tokens += _final_request_tokens
-                    _response_tokens += _final_response_tokens
-                    _processing_cost += _final_cost
-                else:
-                    _summary = self.command.generate_summary(
-                        _chunks[0]["text"],
-                        prompt=prompt,
-                        output_format=output_format,
-                        endings=output_endings,
-                        provider=self.provider,
-                        **config
-                    )
-                    _summary_text = _summary.text
-                    _request_tokens += _summary.request_tokens
-                    _response_tokens += _summary.response_tokens
-                    _processing_cost += _summary.cost
-
-                    if self.command.debug and self.command.verbosity > 2:
-                        self.command.notice(
-                            """
+    def _merge_chunk_results(self, results):
+        request_tokens = 0
+        response_tokens = 0
+        processing_cost = 0
+        chunk_text = {}
+
+        for result in results:
+            chunk_text[result["index"]] = result["text"]
+            request_tokens += result["request_tokens"]
+            response_tokens += result["response_tokens"]
+            processing_cost += result["cost"]
+
+        return (
+            [chunk_text[index] for index in sorted(chunk_text.keys())],
+            request_tokens,
+            response_tokens,
+            processing_cost,
+        )
+
+    def _get_reducer(self, prompt, persona, output_format, fan_in):
+        return TreeReducer(
+            self.command,
+            self.summarizer,
+            self.summarizer.get_chunk_length(),
+            self.summarizer.get_prompt_token_count(prompt, persona, output_format),
+            fan_in=fan_in,
+        )
+
+    def _display_summary(self, text, request_tokens, response_tokens, cost):
+        if self.command.debug and self.command.verbosity > 2:
+            self.command.notice(
+                """
 **================================**
 {}
 **................................**
@@ -149,30 +97,24 @@ Request Tokens: {}
 Response Tokens: {}
 Summary Cost: ${}
 """.format(
-                                _summary_text,
-                                _request_tokens,
-                                _response_tokens,
-                                _processing_cost,
-                            )
-                        )
-
-            return (
-                _summary_text.strip(),
-                _request_tokens,
-                _response_tokens,
-                _processing_cost,
+                    text,
+                    request_tokens,
+                    response_tokens,
+                    cost,
+                )
             )
 
-        start_time = time.time()
-
-        if self.text is not None:
-            summary_text, request_tokens, response_tokens, cost = summarize(self.text)
-        else:
-            summary_text = self.no_info_message
-            request_tokens = 0
-            response_tokens = 0
-            cost = 0
-
+    def _get_summary(
+        self,
+        start_time,
+        summary_text,
+        request_tokens,
+        response_tokens,
+        cost,
+        reduce_depth=0,
+        reduce_levels=None,
+        chunk_stats=None,
+    ):
         return Collection(
             text=summary_text,
             request_tokens=request_tokens,
@@ -180,4 +122,188 @@ Summary Cost: ${}
             token_count=(request_tokens + response_tokens),
             processing_time=(time.time() - start_time),
             processing_cost=cost,
+            reduce_depth=reduce_depth,
+            reduce_levels=reduce_levels if reduce_levels else [],
+            **(chunk_stats if chunk_stats else get_chunk_stats([])),
+        )
+
+    def _get_map_chunks(self, prompt, output_format, persona, max_chunks=None):
+        chunks = self._get_chunks(
+            self.text, prompt=prompt, output_format=output_format, persona=persona
+        )
+        dropped = 0
+
+        if max_chunks and len(chunks) > max_chunks:
+            # The whole text is chunked first so the lost tail can be reported
+            dropped = len(chunks) - max_chunks
+            chunks = chunks[:max_chunks]
+            self.command.warning(
+                "Summary text exceeds {} chunks, dropping the last {}".format(
+                    max_chunks, dropped
+                )
+            )
+        return [
+            {"index": index, "text": chunk} for index, chunk in enumerate(chunks)
+        ], dropped
+
+    def _get_reduce_summary(
+        self, start_time, reduction, chunk_stats, request_tokens, response_tokens, cost
+    ):
+        self._display_summary(
+            reduction.text,
+            reduction.request_tokens,
+            reduction.response_tokens,
+            reduction.cost,
+        )
+        return self._get_summary(
+            start_time,
+            reduction.text.strip() or self.no_info_message,
+            request_tokens + reduction.request_tokens,
+            response_tokens + reduction.response_tokens,
+            cost + reduction.cost,
+            reduction.depth,
+            reduction.levels,
+            chunk_stats,
+        )
+
+    def generate(
+        self,
+        prompt,
+        output_format="",
+        output_endings=None,
+        fan_in=None,
+        max_chunks=None,
+        **config
+    ):
+        persona = config.get("persona", "")
+
+        if output_endings is None:
+            output_endings = [".", "?", "!"]
+
+        def generate_summary(info):
+            _summary = self.command.generate_summary(
+                info["text"], prompt=prompt, provider=self.provider, **config
+            )
+            return self._get_chunk_result(info, _summary)
+
+        def reduce_summary(text):
+            return self.command.generate_summary(
+                text, prompt=prompt, provider=self.provider, **config
+            )
+
+        def final_summary(text):
+            return self.command.generate_summary(
+                text,
+                prompt=prompt,
+                output_format=output_format,
+                endings=output_endings,
+                provider=self.provider,
+                **config
+            )
+
+        start_time = time.time()
+
+        if self.text is None:
+            return self._get_summary(start_time, self.no_info_message, 0, 0, 0)
+
+        chunks, dropped = self._get_map_chunks(
+            prompt, output_format, persona, max_chunks
+        )
+        if len(chunks) > 1:
+            results = [
+                chunk.result
+                for chunk in self.command.run_list(chunks, generate_summary).data
+            ]
+            texts, request_tokens, response_tokens, cost = self._merge_chunk_results(
+                results
+            )
+        else:
+            results = []
+            texts = [chunks[0]["text"]]
+            request_tokens = 0
+            response_tokens = 0
+            cost = 0
+
+        return self._get_reduce_summary(
+            start_time,
+            self._get_reducer(prompt, persona, output_format, fan_in).reduce(
+                texts, reduce_summary, final_summary
+            ),
+            get_chunk_stats(results, dropped),
+            request_tokens,
+            response_tokens,
+            cost,
+        )
+
+    async def agenerate(
+        self,
+        prompt,
+        output_format="",
+        output_endings=None,
+        fan_in=None,
+        max_chunks=None,
+        concurrency=None,
+        **config
+    ):
+        persona = config.get("persona", "")
+        semaphore = asyncio.Semaphore(
+            concurrency if concurrency else settings.SUMMARIZER_MAP_CONCURRENCY
+        )
+
+        if output_endings is None:
+            output_endings = [".", "?", "!"]
+
+        async def generate_summary(info):
+            async with semaphore:
+                _summary = await self.command.agenerate_summary(
+                    info["text"], prompt=prompt, provider=self.provider, **config
+                )
+            return self._get_chunk_result(info, _summary)
+
+        async def reduce_summary(text):
+            return await self.command.agenerate_summary(
+                text, prompt=prompt, provider=self.provider, **config
+            )
+
+        async def final_summary(text):
+            return await self.command.agenerate_summary(
+                text,
+                prompt=prompt,
+                output_format=output_format,
+                endings=output_endings,
+                provider=self.provider,
+                **config
+            )
+
+        start_time = time.time()
+
+        if self.text is None:
+            return self._get_summary(start_time, self.no_info_message, 0, 0, 0)
+
+        chunks, dropped = self._get_map_chunks(
+            prompt, output_format, persona, max_chunks
+        )
+        if len(chunks) > 1:
+            results = await asyncio.gather(
+                *[generate_summary(chunk) for chunk in chunks]
+            )
+            texts, request_tokens, response_tokens, cost = self._merge_chunk_results(
+                results
+            )
+        else:
+            results = []
+            texts = [chunks[0]["text"]]
+            request_tokens = 0
+            response_tokens = 0
+            cost = 0
+
+        return self._get_reduce_summary(
+            start_time,
+            await self._get_reducer(prompt, persona, output_format, fan_in).areduce(
+                texts, reduce_summary, final_summary, concurrency=concurrency
+            ),
+            get_chunk_stats(results, dropped),
+            request_tokens,
+            response_tokens,
+            cost,
         )
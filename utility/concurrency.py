@@ -0,0 +1,293 @@
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+import asyncio
+import os
+import threading
+import time
+import requests
+
+
+class AdaptiveLimiter(object):
+
+    latency_alpha = 0.3
+    baseline_alpha = 0.02
+
+    def __init__(
+        self,
+        name,
+        initial=None,
+        minimum=None,
+        maximum=None,
+        latency_tolerance=None,
+        decrease_factor=0.5,
+    ):
+        self.name = name
+        self.minimum = (
+            minimum if minimum is not None else settings.DEEPINFRA_CONCURRENCY_MIN
+        )
+        self.maximum = (
+            maximum if maximum is not None else settings.DEEPINFRA_CONCURRENCY_MAX
+        )
+        self.limit = float(
+            initial if initial is not None else settings.DEEPINFRA_CONCURRENCY_INITIAL
+        )
+        self.latency_tolerance = float(
+            latency_tolerance
+            if latency_tolerance is not None
+            else settings.DEEPINFRA_LATENCY_TOLERANCE
+        )
+        self.decrease_factor = decrease_factor
+
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.async_waiters = deque()
+        self.in_flight = 0
+
+        self.latency = None
+        self.baseline = None
+        self.last_decrease = 0
+
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    @property
+    def capacity(self):
+        return max(int(self.limit), self.minimum)
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.capacity:
+                self.condition.wait()
+            self.in_flight += 1
+
+    async def aacquire(self):
+        with self.lock:
+            if self.in_flight < self.capacity and not self.async_waiters:
+                self.in_flight += 1
+                return
+
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.async_waiters.append((loop, future))
+        try:
+            await future
+        except asyncio.CancelledError as e:
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise e
+
+    def release(self, latency=None, throttled=False, error=False):
+        with self.lock:
+            self.requests += 1
+
+            if throttled:
+                self.throttled += 1
+                self._decrease()
+            elif error:
+                self.errors += 1
+            elif latency is not None:
+                self._update_latency(latency)
+
+            self.in_flight -= 1
+            self._wake()
+
+    def _release_slot(self):
+        with self.lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _update_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+            self.baseline = latency
+        else:
+            self.latency += self.latency_alpha * (latency - self.latency)
+            self.baseline += self.baseline_alpha * (latency - self.baseline)
+            self.baseline = min(self.baseline, self.latency)
+
+        if self.latency <= (self.baseline * self.latency_tolerance):
+            # Additive increase of one slot per window of successful requests
+            self.limit = min(self.limit + (1 / self.limit), float(self.maximum))
+        else:
+            self._decrease()
+
+    def _decrease(self):
+        # Only back off once per observed latency window so a burst of
+        # throttled responses from the same window does not collapse the limit
+        now = time.time()
+        if (now - self.last_decrease) >= (self.latency if self.latency else 1):
+            self.limit = max(self.limit * self.decrease_factor, float(self.minimum))
+            self.last_decrease = now
+
+    def _wake(self):
+        while self.async_waiters and self.in_flight < self.capacity:
+            loop, future = self.async_waiters.popleft()
+            if future.done():
+                continue
+
+            self.in_flight += 1
+            loop.call_soon_threadsafe(self._grant, future)
+
+        self.condition.notify_all()
+
+    def _grant(self, future):
+        if future.cancelled():
+            self._release_slot()
+        else:
+            future.set_result(True)
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "baseline": round(self.baseline, 3) if self.baseline is not None else None,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "errors": self.errors,
+        }
+
+
+_limiters = {}
+_limiter_pid = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter(url):
+    global _limiter_pid
+
+    name = urlparse(url).netloc
+    with _limiter_lock:
+        if _limiter_pid != os.getpid():
+            _limiters.clear()
+            _limiter_pid = os.getpid()
+
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(name)
+        return _limiters[name]
+
+
+def get_limiter_stats():
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
+
+
+def is_throttled(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def get_retry_wait(attempt, headers=None):
+    retry_after = (headers or {}).get("Retry-After", None)
+    if retry_after:
+        try:
+            return min(float(retry_after), settings.DEEPINFRA_RETRY_MAX_WAIT)
+        except ValueError:
+            pass
+    return min(
+        settings.DEEPINFRA_RETRY_WAIT * (2**attempt), settings.DEEPINFRA_RETRY_MAX_WAIT
+    )
+
+
+def _get_response(limiter, request, max_retries):
+    # Returns with the limiter slot still held so callers release it once the
+    # response body has been fully read
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        start_time = time.time()
+        try:
+            response = request()
+
+        except BaseException as e:
+            limiter.release(error=True)
+            if attempt >= max_retries or not isinstance(
+                e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+            ):
+                raise e
+            time.sleep(get_retry_wait(attempt))
+            continue
+
+        throttled = is_throttled(response.status_code)
+        if throttled and attempt < max_retries:
+            limiter.release(latency=(time.time() - start_time), throttled=True)
+            response.close()
+            time.sleep(get_retry_wait(attempt, response.headers))
+            continue
+
+        return response, start_time, throttled
+
+
+async def _aget_response(limiter, request, max_retries):
+    import aiohttp
+
+    for attempt in range(max_retries + 1):
+        await limiter.aacquire()
+        start_time = time.time()
+        try:
+            response = await request()
+
+        except BaseException as e:
+            limiter.release(error=True)
+            if attempt >= max_retries or not isinstance(
+                e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+            ):
+                raise e
+            await asyncio.sleep(get_retry_wait(attempt))
+            continue
+
+        throttled = is_throttled(response.status_code)
+        if throttled and attempt < max_retries:
+            limiter.release(latency=(time.time() - start_time), throttled=True)
+            if getattr(response, "close", None):
+                response.close()
+            await asyncio.sleep(get_retry_wait(attempt, response.headers))
+            continue
+
+        return response, start_time, throttled
+
+
+@contextmanager
+def limited_response(url, request, max_retries=None):
+    limiter = get_limiter(url)
+    response, start_time, throttled = _get_response(
+        limiter,
+        request,
+        max_retries if max_retries is not None else settings.DEEPINFRA_MAX_RETRIES,
+    )
+    # The slot and the measured latency cover the whole body so streamed
+    # generations count as in flight until they are read or closed
+    try:
+        yield response
+    except BaseException as e:
+        limiter.release(throttled=throttled, error=(not throttled))
+        raise e
+    limiter.release(latency=(time.time() - start_time), throttled=throttled)
+
+
+@asynccontextmanager
+async def alimited_response(url, request, max_retries=None):
+    limiter = get_limiter(url)
+    response, start_time, throttled = await _aget_response(
+        limiter,
+        request,
+        max_retries if max_retries is not None else settings.DEEPINFRA_MAX_RETRIES,
+    )
+    try:
+        yield response
+    except BaseException as e:
+        limiter.release(throttled=throttled, error=(not throttled))
+        raise e
+    limiter.release(latency=(time.time() - start_time), throttled=throttled)
+
+
+def run_limited(url, request, max_retries=None):
+    with limited_response(url, request, max_retries) as response:
+        return response
+
+
+async def arun_limited(url, request, max_retries=None):
+    async with alimited_response(url, request, max_retries) as response:
+        return response
@@ -0,0 +1,289 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+
+
+class MockDeepInfraHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server.mock
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        start_time = time.time()
+
+        try:
+            request = json.loads(body) if body else {}
+        except ValueError:
+            return self._send_json(400, {"error": "Invalid JSON request body"})
+
+        if self.path.startswith("/v1/openai/chat/completions"):
+            endpoint = "chat"
+        elif self.path.startswith("/v1/inference/sentence-transformers/"):
+            endpoint = "embeddings"
+        else:
+            return self._send_json(404, {"error": "Unknown endpoint"})
+
+        failure = server.get_failure()
+        if failure:
+            time.sleep(server.get_latency() * 0.1)
+            server.record(endpoint, failure, time.time() - start_time)
+            return self._send_json(
+                failure, {"error": "Mock failure"}, {"Retry-After": "0"}
+            )
+
+        if endpoint == "chat":
+            if request.get("stream", False):
+                self._send_stream(server, request)
+            else:
+                self._send_json(200, server.get_completion(request))
+        else:
+            self._send_json(200, server.get_embeddings(request))
+
+        server.record(endpoint, 200, time.time() - start_time)
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        if status == 200:
+            time.sleep(self.server.mock.get_latency())
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, server, request):
+        completion = server.get_completion(request)
+        text = completion["choices"][0]["message"]["content"]
+        tokens = re.findall(r"\S+\s*", text)
+        token_delay = server.get_latency() / max(len(tokens), 1)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        try:
+            for token in tokens:
+                time.sleep(token_delay)
+                self._send_event(
+                    {"choices": [{"index": 0, "delta": {"content": token}}]}
+                )
+            self._send_event(
+                {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            )
+            self._send_event({"choices": [], "usage": completion["usage"]})
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+
+        except (BrokenPipeError, ConnectionResetError):
+            # Client closed the stream early
+            self.close_connection = True
+
+    def _send_event(self, data):
+        self._send_chunk("data: {}\n\n".format(json.dumps(data)).encode("utf-8"))
+
+    def _send_chunk(self, data):
+        self.wfile.write("{:x}\r\n".format(len(data)).encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockDeepInfraServer(object):
+
+    words = (
+        "the report describes system performance across regions with notable growth "
+        "in adoption while costs remain stable and teams continue improving "
+        "reliability through careful planning and measured investment"
+    ).split()
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency_median=0.5,
+        latency_sigma=0.5,
+        error_rate=0,
+        throttle_rate=0,
+        output_tokens=80,
+        no_info_rate=0,
+        cost_per_token=0.0000003,
+        dimension=768,
+        seed=0,
+    ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.output_tokens = output_tokens
+        self.no_info_rate = no_info_rate
+        self.cost_per_token = cost_per_token
+        self.dimension = dimension
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+
+        self.server = ThreadingHTTPServer((host, port), MockDeepInfraHandler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get_latency(self):
+        if not self.latency_median:
+            return 0
+        with self.lock:
+            return self.random.lognormvariate(
+                math.log(self.latency_median), self.latency_sigma
+            )
+
+    def get_failure(self):
+        with self.lock:
+            value = self.random.random()
+        if value < self.throttle_rate:
+            return 429
+        if value < (self.throttle_rate + self.error_rate):
+            return 500
+        return None
+
+    def record(self, endpoint, status, latency):
+        with self.lock:
+            info = self.requests.setdefault(
+                endpoint, {"count": 0, "failures": 0, "latencies": []}
+            )
+            info["count"] += 1
+            if status != 200:
+                info["failures"] += 1
+            info["latencies"].append(latency)
+
+    def _get_digest(self, data):
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True).encode("utf-8")
+        ).digest()
+
+    def get_completion(self, request):
+        messages = request.get("messages", [])
+        digest = self._get_digest(messages)
+        prompt_tokens = sum(
+            [len(str(message.get("content", "")).split()) for message in messages]
+        )
+
+        if self.no_info_rate and (digest[0] / 256) < self.no_info_rate:
+            text = "No information available."
+        else:
+            length = min(
+                self.output_tokens, int(request.get("max_tokens", self.output_tokens))
+            )
+            generator = random.Random(digest)
+            words = [generator.choice(self.words) for index in range(length)]
+            text = "{}.".format(" ".join(words).capitalize())
+
+        completion_tokens = len(text.split())
+        return {
+            "id": digest.hex()[:24],
+            "object": "chat.completion",
+            "model": request.get("model", None),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "estimated_cost": (prompt_tokens + completion_tokens)
+                * self.cost_per_token,
+            },
+        }
+
+    def get_embeddings(self, request):
+        embeddings = []
+        for text in request.get("inputs", []):
+            generator = random.Random(self._get_digest(text))
+            embeddings.append(
+                [generator.uniform(-1, 1) for index in range(self.dimension)]
+            )
+        return {
+            "embeddings": embeddings,
+            "input_tokens": sum(
+                [len(str(text).split()) for text in request.get("inputs", [])]
+            ),
+        }
+
+    def stats(self):
+        stats = {}
+        with self.lock:
+            for endpoint, info in self.requests.items():
+                stats[endpoint] = {
+                    "count": info["count"],
+                    "failures": info["failures"],
+                    **get_percentiles(info["latencies"]),
+                }
+        return stats
+
+
+def get_sample_text(seed, paragraphs):
+    generator = random.Random(seed)
+    text = []
+
+    for paragraph_index in range(paragraphs):
+        sentences = []
+        for sentence_index in range(generator.randint(3, 6)):
+            words = [
+                generator.choice(MockDeepInfraServer.words)
+                for word_index in range(generator.randint(8, 20))
+            ]
+            sentences.append("{}.".format(" ".join(words).capitalize()))
+        text.append(" ".join(sentences))
+
+    return "\n\n".join(text)
+
+
+def get_percentiles(values, percentiles=(50, 90, 99)):
+    values = sorted(values)
+    stats = {}
+
+    for percentile in percentiles:
+        if values:
+            index = min(
+                len(values) - 1, max(0, math.ceil(percentile / 100 * len(values)) - 1)
+            )
+            stats["p{}".format(percentile)] = round(values[index], 3)
+        else:
+            stats["p{}".format(percentile)] = None
+    return stats
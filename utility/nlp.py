@@ -0,0 +1,53 @@
+from django.conf import settings
+
+import gc
+import threading
+import time
+import spacy
+
+
+# Components no parser in this module reads, never loaded into shared models
+default_exclude = ("ner",)
+
+_models = {}
+_model_stats = {}
+_model_lock = threading.Lock()
+
+
+def _get_model_key(name, exclude):
+    return (name, tuple(sorted(set(exclude if exclude else []))))
+
+
+def get_spacy_model(name, exclude=default_exclude):
+    key = _get_model_key(name, exclude)
+
+    # Models are not reloaded after a fork so workers share the pages of
+    # models loaded by the parent process until they are written to
+    with _model_lock:
+        if key not in _models:
+            start_time = time.time()
+            _models[key] = spacy.load(name, exclude=list(key[1]))
+            _model_stats[key] = {
+                "model": name,
+                "exclude": list(key[1]),
+                "pipeline": list(_models[key].pipe_names),
+                "load_time": round(time.time() - start_time, 3),
+            }
+        return _models[key]
+
+
+def get_spacy_model_stats():
+    with _model_lock:
+        return list(_model_stats.values())
+
+
+def preload_spacy_models(names=None):
+    names = names if names is not None else settings.SPACY_PRELOAD_MODELS
+    for name in names:
+        get_spacy_model(name)
+
+    if names:
+        # Objects loaded before a fork are moved out of the collector so
+        # reference scans in workers do not copy their pages
+        gc.freeze()
+    return get_spacy_model_stats()
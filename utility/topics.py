@@ -1,48 +1,88 @@
+from django.conf import settings
 from spacy.lang.en import stop_words
 
+from utility.cache import LRUCache, get_hash_key
+from utility.nlp import get_spacy_model
+
 import re
-import spacy
 
 
-class TopicModel(object):
+class TopicIndex(object):
 
-    text_max_length = 100000
+    min_similarity = 0.8
 
-    invalid_chars = r'([^\x00-\x7F]|\d+|\'|\"|\?|\(|\)|\[|\]|\||\=|\.)'
-    word_types = ['PRON', 'ADP', 'ADV', 'VERB', 'DET', 'CCONJ', 'SCONJ']
 
+    def __init__(self, search_topics):
+        self.topics = {}
+        self.lengths = set()
+        self.weights = {}
 
-    def __init__(self):
-        self.spacy = spacy.load('en_core_web_lg')
-        self.spacy.max_length = self.text_max_length
+        for topic in search_topics:
+            if topic:
+                self.topics[topic] = self.topics.get(topic, 0) + 1
+                self.lengths.add(len(topic))
 
 
-    def get_topic_score(self, search_topics, *topic_args):
-        topic_map = {}
+    def get_weight(self, doc_topic):
+        # A search topic only scores against a document topic it is a substring
+        # of that is at most 1 / min_similarity times longer, so only substrings
+        # of those lengths are looked up instead of testing every search topic
+        if doc_topic not in self.weights:
+            doc_length = len(doc_topic)
+            matches = set()
 
-        def increment_topic(topic, count = 1):
-            if topic not in topic_map:
-                topic_map[topic] = count
-            else:
-                topic_map[topic] += count
+            for length in self.lengths:
+                if length <= doc_length and (length / doc_length) >= self.min_similarity:
+                    for index in range(doc_length - length + 1):
+                        topic = doc_topic[index:index + length]
+                        if topic in self.topics:
+                            matches.add(topic)
+
+            self.weights[doc_topic] = sum([ self.topics[topic] for topic in matches ])
+        return self.weights[doc_topic]
+
+
+    def get_topic_score(self, *topic_args):
+        topic_score = 0
 
         for topics in topic_args:
             if isinstance(topics, list):
                 for topic in topics:
-                    increment_topic(topic)
+                    topic_score += self.get_weight(topic)
             elif isinstance(topics, dict):
                 for key, value in topics.items():
-                    increment_topic(key, value)
-
-        topic_score = 0
-        for topic in search_topics:
-            for doc_topic in topic_map.keys():
-                char_similarity = (len(topic) / len(doc_topic)) if topic in doc_topic else 0
-                if char_similarity >= 0.8:
-                    topic_score += topic_map[doc_topic]
+                    topic_score += self.get_weight(key) * value
 
         return topic_score
 
+    def get_topic_scores(self, topic_maps):
+        return [ self.get_topic_score(topics) for topics in topic_maps ]
+
+
+class TopicModel(object):
+
+    model_name = 'en_core_web_lg'
+    text_max_length = 100000
+
+    invalid_chars = r'([^\x00-\x7F]|\d+|\'|\"|\?|\(|\)|\[|\]|\||\=|\.)'
+    word_types = ['PRON', 'ADP', 'ADV', 'VERB', 'DET', 'CCONJ', 'SCONJ']
+
+    cache = LRUCache(settings.TOPIC_CACHE_SIZE)
+    state_stats = { 'hits': 0, 'misses': 0 }
+
+
+    def __init__(self, command = None):
+        # Shared across the process so the model is never mutated here
+        self.spacy = get_spacy_model(self.model_name)
+        self.command = command
+
+
+    def get_topic_index(self, search_topics):
+        return TopicIndex(search_topics)
+
+    def get_topic_score(self, search_topics, *topic_args):
+        return self.get_topic_index(search_topics).get_topic_score(*topic_args)
+
 
     def filtered_index(self, full_texts, context_texts):
         context_index = self.get_index(*context_texts)
@@ -56,8 +96,8 @@ class TopicModel(object):
 
     def get_index(self, *texts):
         index = {}
-        for text in texts:
-            for topic in self.parse(str(text).strip()):
+        for topics in self.parse_many([ str(text).strip() for text in texts ]):
+            for topic in topics:
                 if topic not in index:
                     index[topic] = 1
                 else:
@@ -76,24 +116,127 @@ class TopicModel(object):
         return " ".join(singular).strip()
 
 
-    def parse(self, text):
-        if len(text) >= self.text_max_length:
+    def get_segments(self, text):
+        segments = []
+        while len(text) >= self.text_max_length:
             sentence_index = None
             for match in re.finditer(r'([^\.]\.|\?|\!)(?=\s+)', text[:self.text_max_length], re.MULTILINE):
                 sentence_index = match.end()
             sentence_index = sentence_index if sentence_index else self.text_max_length
 
-            topics = [
-                *self._parse(text[:sentence_index].strip()),
-                *self.parse(text[sentence_index:].strip())
-            ]
-        else:
-            topics = self._parse(text)
+            segments.append(text[:sentence_index].strip())
+            text = text[sentence_index:].strip()
 
-        return topics
+        segments.append(text)
+        return segments
+
+
+    def get_cache_stats(self):
+        state_requests = self.state_stats['hits'] + self.state_stats['misses']
+        return {
+            **self.cache.stats(),
+            'state_hits': self.state_stats['hits'],
+            'state_misses': self.state_stats['misses'],
+            'state_hit_ratio': round(self.state_stats['hits'] / state_requests, 3) if state_requests else 0
+        }
+
+    def _get_cache_key(self, text):
+        return "{}.{}".format(self.model_name, get_hash_key(text).hex())
+
+    def _get_state_name(self, state_key):
+        return "ml.topics.{}.{}".format(self.model_name, state_key)
+
+    def _get_state_topics(self, state_key, cache_key):
+        state = self.command.get_state(self._get_state_name(state_key), None)
+        if state and state.get('hash', None) == cache_key:
+            self.state_stats['hits'] += 1
+            return state['topics']
+
+        self.state_stats['misses'] += 1
+        return None
+
+
+    def parse(self, text, cache = True, state_key = None):
+        return self.parse_many([ text ], cache = cache,
+            state_keys = [ state_key ] if state_key else None
+        )[0]
+
+    def parse_many(self, texts, batch_size = None, n_process = None, cache = True, state_keys = None):
+        if not cache:
+            return self._parse_many(texts, batch_size, n_process)
+
+        # Stored topics are addressed by a stable key such as a document id and
+        # replaced when the text hash changes, so there is one entry per key
+        if self.command is None or not state_keys:
+            state_keys = [ None ] * len(texts)
+
+        text_topics = [ None ] * len(texts)
+        missing = {}
+
+        for index, text in enumerate(texts):
+            key = self._get_cache_key(text)
+            state_key = state_keys[index]
+            topics = self.cache.get(key)
+
+            if topics is None and state_key:
+                topics = self._get_state_topics(state_key, key)
+                if topics is not None:
+                    self.cache.set(key, topics)
+
+            if topics is None:
+                missing.setdefault(key, (text, [], set()))
+                missing[key][1].append(index)
+                if state_key:
+                    missing[key][2].add(state_key)
+            else:
+                text_topics[index] = list(topics)
+
+        if missing:
+            missing_info = list(missing.items())
+            for (key, (text, indexes, missing_state_keys)), topics in zip(
+                missing_info,
+                self._parse_many([ info[1][0] for info in missing_info ], batch_size, n_process)
+            ):
+                for state_key in missing_state_keys:
+                    self.command.set_state(self._get_state_name(state_key), {
+                        'hash': key,
+                        'topics': topics
+                    })
+                self.cache.set(key, topics)
+
+                for index in indexes:
+                    text_topics[index] = list(topics)
+
+        return text_topics
+
+    def _parse_many(self, texts, batch_size = None, n_process = None):
+        text_topics = [ [] for text in texts ]
+        text_indexes = []
+        segments = []
+
+        for text_index, text in enumerate(texts):
+            for segment in self.get_segments(text):
+                text_indexes.append(text_index)
+                segments.append(segment)
+
+        if len(segments) == 1:
+            # Single texts skip the batch pipeline and its worker processes
+            text_topics[0].extend(self._parse(segments[0]))
+            return text_topics
+
+        parsers = self.spacy.pipe(segments,
+            batch_size = batch_size if batch_size else settings.TOPIC_PARSER_BATCH_SIZE,
+            n_process = n_process if n_process else settings.TOPIC_PARSER_PROCESSES
+        )
+        for text_index, parser in zip(text_indexes, parsers):
+            text_topics[text_index].extend(self._get_topics(parser))
+
+        return text_topics
 
     def _parse(self, text):
-        parser = self.spacy(text)
+        return self._get_topics(self.spacy(text))
+
+    def _get_topics(self, parser):
         topics = []
 
         for chunk in parser.noun_chunks:
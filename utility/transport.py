@@ -0,0 +1,257 @@
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+import asyncio
+import os
+import threading
+import requests
+
+
+class PooledTransport(object):
+
+    def __init__(
+        self, pool_connections=None, pool_maxsize=None, timeout=None, connect_timeout=None
+    ):
+        self.pool_connections = (
+            pool_connections
+            if pool_connections is not None
+            else settings.HTTP_POOL_CONNECTIONS
+        )
+        self.pool_maxsize = (
+            pool_maxsize if pool_maxsize is not None else settings.HTTP_POOL_MAXSIZE
+        )
+        self.timeout = timeout if timeout is not None else settings.HTTP_REQUEST_TIMEOUT
+        self.connect_timeout = (
+            connect_timeout
+            if connect_timeout is not None
+            else settings.HTTP_CONNECT_TIMEOUT
+        )
+
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+        self.adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=False,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def request(self, method, url, timeout=None, **options):
+        if timeout is None:
+            timeout = self.timeout
+
+        with self.lock:
+            self.requests += 1
+        try:
+            return self.session.request(
+                method, url, timeout=(self.connect_timeout, timeout), **options
+            )
+        except requests.exceptions.RequestException as e:
+            with self.lock:
+                self.errors += 1
+            raise e
+
+    def post(self, url, **options):
+        return self.request("POST", url, **options)
+
+    def get(self, url, **options):
+        return self.request("GET", url, **options)
+
+    def stats(self):
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+
+            host_stats = hosts.setdefault(
+                pool.host, {"connections": 0, "requests": 0}
+            )
+            host_stats["connections"] += pool.num_connections
+            host_stats["requests"] += pool.num_requests
+
+        connections = sum(host["connections"] for host in hosts.values())
+        pool_requests = sum(host["requests"] for host in hosts.values())
+
+        for host_stats in hosts.values():
+            host_stats["reused"] = max(
+                host_stats["requests"] - host_stats["connections"], 0
+            )
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "connections": connections,
+            "reused": max(pool_requests - connections, 0),
+            "reuse_ratio": (
+                round(1 - (connections / pool_requests), 3) if pool_requests else 0
+            ),
+            "hosts": hosts,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _transport
+
+    # Sessions are not fork safe so each process gets its own connection pool
+    with _transport_lock:
+        if _transport is None or _transport.pid != os.getpid():
+            _transport = PooledTransport()
+        return _transport
+
+
+class AsyncResponse(object):
+
+    def __init__(self, status_code, text, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers if headers else {}
+
+
+class AsyncStreamResponse(object):
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status
+        self.headers = dict(response.headers)
+
+    async def text(self):
+        return await self.response.text()
+
+    async def iter_lines(self):
+        async for line in self.response.content:
+            yield line.decode("utf-8")
+
+    def close(self):
+        # Returns fully read connections to the pool and drops partial ones
+        self.response.release()
+
+
+class AsyncTransport(object):
+
+    def __init__(self, pool_maxsize=None, timeout=None, connect_timeout=None):
+        import aiohttp
+
+        self.pool_maxsize = (
+            pool_maxsize if pool_maxsize is not None else settings.HTTP_POOL_MAXSIZE
+        )
+        self.timeout = timeout if timeout is not None else settings.HTTP_REQUEST_TIMEOUT
+        self.connect_timeout = (
+            connect_timeout
+            if connect_timeout is not None
+            else settings.HTTP_CONNECT_TIMEOUT
+        )
+
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        self.reused = 0
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_maxsize),
+            timeout=aiohttp.ClientTimeout(
+                total=self.timeout, sock_connect=self.connect_timeout
+            ),
+            trace_configs=[trace_config],
+        )
+
+    async def _on_connection_create(self, session, context, params):
+        self.connections += 1
+
+    async def _on_connection_reuse(self, session, context, params):
+        self.reused += 1
+
+    async def request(self, method, url, timeout=None, **options):
+        import aiohttp
+
+        if timeout is not None:
+            options["timeout"] = aiohttp.ClientTimeout(
+                total=timeout, sock_connect=self.connect_timeout
+            )
+
+        self.requests += 1
+        try:
+            async with self.session.request(method, url, **options) as response:
+                return AsyncResponse(
+                    response.status, await response.text(), dict(response.headers)
+                )
+        except aiohttp.ClientError as e:
+            self.errors += 1
+            raise e
+
+    async def open(self, method, url, timeout=None, **options):
+        import aiohttp
+
+        if timeout is not None:
+            options["timeout"] = aiohttp.ClientTimeout(
+                total=timeout, sock_connect=self.connect_timeout
+            )
+
+        self.requests += 1
+        try:
+            return AsyncStreamResponse(
+                await self.session.request(method, url, **options)
+            )
+        except aiohttp.ClientError as e:
+            self.errors += 1
+            raise e
+
+    async def post(self, url, **options):
+        return await self.request("POST", url, **options)
+
+    async def get(self, url, **options):
+        return await self.request("GET", url, **options)
+
+    def stats(self):
+        total = self.connections + self.reused
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "connections": self.connections,
+            "reused": self.reused,
+            "reuse_ratio": round(self.reused / total, 3) if total else 0,
+        }
+
+    async def close(self):
+        await self.session.close()
+
+
+_async_transports = {}
+
+
+def get_async_transport():
+    # aiohttp sessions are bound to the event loop that created them
+    loop = asyncio.get_running_loop()
+    if loop not in _async_transports:
+        _async_transports[loop] = AsyncTransport()
+    return _async_transports[loop]
+
+
+def run_async(coroutine):
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            transport = _async_transports.pop(asyncio.get_running_loop(), None)
+            if transport:
+                await transport.close()
+
+    return asyncio.run(run())